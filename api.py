@@ -0,0 +1,81 @@
+import os
+import json
+import threading
+from dotenv import load_dotenv, find_dotenv
+from flask import Flask, Response, request, jsonify, stream_with_context
+
+import chat_core
+
+# ==============================================
+# Flask API service for FB → Chatbot forwarding
+# ==============================================
+# Run with `gunicorn api:api`. Imports only the UI-free chat core, so a worker
+# starts without executing any Streamlit code or embedding anything at import.
+# The retrieval engine and intent classifier are warmed in a background thread
+# (set API_WARM_START=0 to build them on the first request instead).
+# POST {"message": ..., "sender_id": ...}; with a sender_id the reply sees
+# that sender's earlier turns (session_store.py).
+_ = load_dotenv(find_dotenv())
+
+WARM_START = os.getenv("API_WARM_START", "1") != "0"
+
+api = Flask(__name__)
+
+if WARM_START:
+    threading.Thread(target=chat_core.warm_up, name="api-warm-up", daemon=True).start()
+
+
+@api.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@api.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus scrape target: per-stage latency histograms, tokens, cache hit rates
+    return Response(chat_core.metrics_text(), mimetype="text/plain; version=0.0.4")
+
+@api.route("/endpoint", methods=["POST"])
+def chatbot_endpoint():
+    payload = request.get_json(silent=True) or {}
+    user_message = payload.get("message", "")
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+    # With a sender_id the conversation continues from that sender's history
+    sender_id = payload.get("sender_id")
+
+    # Build RAG prompt + get GPT response (or one cached for the same conversation)
+    prepared = chat_core.prepare_reply(user_message, sender_id)
+    reply = prepared.cached_reply
+    if reply is None:
+        reply = chat_core.complete_messages(prepared.messages, session_key=sender_id)
+    chat_core.finish_reply(prepared, reply)
+
+    return jsonify({"reply": reply})
+
+@api.route("/endpoint/stream", methods=["POST"])
+def chatbot_stream_endpoint():
+    """
+    Server-Sent Events variant of /endpoint: one `data:` event per text delta,
+    then a final `done` event carrying the full reply.
+    """
+    payload = request.get_json(silent=True) or {}
+    user_message = payload.get("message", "")
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+    prepared = chat_core.prepare_reply(user_message, payload.get("sender_id"))
+
+    def generate():
+        if prepared.cached_reply is not None:
+            deltas = [prepared.cached_reply]
+        else:
+            deltas = chat_core.stream_messages(prepared.messages, session_key=prepared.sender_id)
+        parts = []
+        for delta in deltas:
+            parts.append(delta)
+            yield f"data: {json.dumps({'delta': delta})}\n\n"
+        reply = "".join(parts)
+        chat_core.finish_reply(prepared, reply)
+        yield f"event: done\ndata: {json.dumps({'reply': reply})}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,261 @@
+import os
+import json
+import math
+import time
+import asyncio
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv, find_dotenv
+
+import chat_core
+from openai_client import close_async_client
+from metrics import render_prometheus
+
+# ============================================================
+# Async (ASGI) API service for FB → Chatbot forwarding
+# ============================================================
+# Same /endpoint contract as api.py, but the completion is awaited on the async
+# OpenAI client, so a message waiting on OpenAI holds no thread and one process
+# can keep hundreds of messages in flight. Blocking steps (retrieval, response
+# cache) run on a bounded thread pool. Plain ASGI, so no web framework is
+# needed. Run with:
+#   uvicorn asgi_api:app --host 0.0.0.0 --port $PORT --timeout-graceful-shutdown 30
+#
+# Admission control, per process:
+#   ASGI_MAX_CONCURRENCY - messages processed at once (default 200)
+#   ASGI_MAX_QUEUE       - messages waiting for a slot (default 500); beyond
+#                          that the request gets 429 with a Retry-After estimate
+#   ASGI_QUEUE_TIMEOUT   - seconds a message may wait for a slot (default 10)
+#   ASGI_BLOCKING_WORKERS - threads for retrieval/cache work (default 64)
+#   ASGI_SHUTDOWN_GRACE  - seconds shutdown waits for in-flight messages (default 30)
+_ = load_dotenv(find_dotenv())
+
+MAX_CONCURRENCY = int(os.getenv("ASGI_MAX_CONCURRENCY", "200"))
+MAX_QUEUE = int(os.getenv("ASGI_MAX_QUEUE", "500"))
+QUEUE_TIMEOUT = float(os.getenv("ASGI_QUEUE_TIMEOUT", "10"))
+BLOCKING_WORKERS = int(os.getenv("ASGI_BLOCKING_WORKERS", "64"))
+SHUTDOWN_GRACE = float(os.getenv("ASGI_SHUTDOWN_GRACE", "30"))
+WARM_START = os.getenv("API_WARM_START", "1") != "0"
+MAX_BODY_BYTES = 64 * 1024
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Overloaded; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Lets max_concurrency requests run and max_queue wait (FIFO); anything
+    beyond that, or waiting longer than queue_timeout, raises Overloaded with a
+    Retry-After estimated from the backlog and the average service time.
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = None  # created on the serving event loop
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.avg_seconds = 1.0  # moving average of service time
+
+    def retry_after(self):
+        backlog = self.active + self.waiting
+        return max(1, math.ceil(backlog * self.avg_seconds / self.max_concurrency))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()  # a slot is free; returns immediately
+        elif self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.retry_after())
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        self.active += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self.avg_seconds = 0.9 * self.avg_seconds + 0.1 * (time.monotonic() - start)
+            self._semaphore.release()
+
+    async def drain(self, timeout):
+        """
+        Wait until no request is running or queued, at most timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while (self.active or self.waiting) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return not (self.active or self.waiting)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_seconds": round(self.avg_seconds, 3),
+        }
+
+
+limiter = AdmissionLimiter()
+_draining = False
+
+
+# ==============================================
+# Request handling
+# ==============================================
+async def _send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get("more_body", False):
+            return body
+
+
+async def answer_message(user_message, sender_id=None):
+    """
+    The /endpoint pipeline (chat_core.prepare_reply / finish_reply) with an
+    async completion on a cache miss.
+    """
+    prepared = await asyncio.to_thread(chat_core.prepare_reply, user_message, sender_id)
+    reply = prepared.cached_reply
+    if reply is None:
+        reply = await chat_core.acomplete_messages(prepared.messages, session_key=sender_id)
+    await asyncio.to_thread(chat_core.finish_reply, prepared, reply)
+    return reply
+
+
+async def chatbot_endpoint(receive, send):
+    if _draining:
+        await _send_json(send, 503, {"error": "Shutting down"}, [(b"retry-after", b"5")])
+        return
+
+    body = await _read_body(receive)
+    if body is None:
+        await _send_json(send, 413, {"error": "Request body too large"})
+        return
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    user_message = payload.get("message", "")
+    if not user_message:
+        await _send_json(send, 400, {"error": "No message provided"})
+        return
+
+    try:
+        async with limiter.slot():
+            reply = await answer_message(user_message, payload.get("sender_id"))
+    except Overloaded as e:
+        await _send_json(send, 429, {"error": "Too many requests"},
+                         [(b"retry-after", str(e.retry_after).encode())])
+        return
+
+    await _send_json(send, 200, {"reply": reply})
+
+
+async def healthz(receive, send):
+    await _send_json(send, 200, dict(limiter.stats(), status="draining" if _draining else "ok"))
+
+
+def _metrics_text():
+    stats = chat_core.collect_stats()
+    stats["chatbot_admission"] = ("Admission limiter queue and rejections.", limiter.stats())
+    return render_prometheus(stats)
+
+
+async def metrics(receive, send):
+    payload = (await asyncio.to_thread(_metrics_text)).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/plain; version=0.0.4"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+ROUTES = {
+    ("POST", "/endpoint"): chatbot_endpoint,
+    ("GET", "/healthz"): healthz,
+    ("GET", "/metrics"): metrics,
+}
+
+
+# ==============================================
+# Lifespan: startup and graceful shutdown
+# ==============================================
+async def _lifespan(receive, send):
+    global _draining
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="asgi-blocking")
+            )
+            if WARM_START:
+                threading.Thread(target=chat_core.warm_up, name="asgi-warm-up", daemon=True).start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Refuse new messages, let in-flight ones finish, then close the pool
+            _draining = True
+            if not await limiter.drain(SHUTDOWN_GRACE):
+                print(f"[ASGI] Shutting down with {limiter.active + limiter.waiting} messages unfinished.")
+            await close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        await _send_json(send, 404, {"error": "Not found"})
+        return
+    await handler(receive, send)
@@ -0,0 +1,78 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+# ============================================================
+# In-memory BM25 Index (lexical retrieval)
+# ============================================================
+# Dense embeddings blur exact terms such as "ACL", condition names and phone
+# numbers; BM25 ranks them well. The retrieval engine fuses both rankings and
+# answers from BM25 alone when it is confident, skipping the embedding call.
+K1 = 1.5
+B = 0.75
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "is", "are", "was",
+    "be", "it", "i", "my", "me", "you", "your", "we", "our", "do", "does", "can", "what",
+    "how", "when", "where", "which", "who", "why", "this", "that", "at", "by", "from", "as",
+    "have", "has", "if", "so", "about", "there", "any", "please",
+}
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, documents, k1=K1, b=B):
+        """
+        documents: list of strings; result ids are positions in this list.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(doc_id, term_freq)]
+        self.doc_lengths = []
+        for doc_id, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                self.postings[term].append((doc_id, freq))
+        self.n_docs = len(documents)
+        self.avg_length = (sum(self.doc_lengths) / self.n_docs) if self.n_docs else 0.0
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=4):
+        """
+        Return [(doc_id, score)] for the top-k documents, best first.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf(term)
+            for doc_id, freq in self.postings.get(term, ()):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1.0))
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def coverage(self, query, doc_id):
+        """
+        Share of the query's IDF weight whose terms appear in the document.
+        """
+        terms = set(tokenize(query))
+        total = sum(self.idf(t) for t in terms)
+        if not total:
+            return 0.0
+        matched = sum(self.idf(t) for t in terms if any(d == doc_id for d, _ in self.postings.get(t, ())))
+        return matched / total
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked id lists; returns ids ordered by summed 1 / (k + rank).
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] += 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(fused.items(), key=lambda item: item[1], reverse=True)]
@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import time
+import logging
+import functools
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAIError, RateLimitError
+
+from knowledge_base import articles
+from retrieval import RetrievalEngine
+from openai_client import get_client, get_async_client, record_usage, get_client_stats, get_usage_stats
+from embeddings import get_embedding, get_cached_embedding, embedding_cache
+from intent_classifier import IntentClassifier
+from sheets_logger import SheetsLogWriter
+from response_cache import ResponseCache
+from context_manager import ContextManager, REPLY_RESERVE, count_message_tokens
+from session_store import SessionStore
+from prompts import static_prefix_messages, format_rag_message
+from metrics import timed, observe, observe_tokens, render_prometheus
+from rate_limiter import get_scheduler, SchedulerTimeout, INTERACTIVE
+from resilience import get_policy, CircuitOpen, DeadlineExceeded, POLICY_DEFAULTS
+
+# ============================================================
+# UI-free Chat Core (RAG + intent + completion)
+# ============================================================
+# Shared by the Streamlit app (main.py) and the API service (api.py). Nothing
+# here touches Streamlit: conversation history and the session key are passed
+# in by the caller. Heavy resources (retrieval engine, classifier, caches,
+# Sheets writer) are built on first use and shared by every thread in the
+# process, so importing this module is cheap and makes no network calls.
+COMPLETION_MODEL = "gpt-3.5-turbo-0125"
+
+# Approximate token budget for retrieved passages in each prompt
+CONTEXT_TOKEN_BUDGET = 600
+
+# Replies returned instead of a completion; these are never cached
+API_KEY_MISSING_REPLY = "API key is missing. Please check your environment settings."
+RATE_LIMIT_REPLY = "We're handling a high volume of requests right now. Please try again in a moment."
+OPENAI_ERROR_REPLY = "Hmm, something went wrong while reaching our assistant. Please try again shortly."
+UNEXPECTED_ERROR_REPLY = "Oops, an unexpected error occurred. Please try again or contact support."
+DEGRADED_REPLY = ("Our assistant is temporarily unavailable. Please try again in a few minutes, "
+                  "or type \"live chat\" to reach our team.")
+FALLBACK_REPLIES = {API_KEY_MISSING_REPLY, RATE_LIMIT_REPLY, OPENAI_ERROR_REPLY, UNEXPECTED_ERROR_REPLY,
+                    DEGRADED_REPLY}
+
+
+def process_singleton(factory):
+    """
+    Build factory() once per process on first call (thread-safe), the
+    framework-free counterpart of st.cache_resource.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    return get
+
+
+# ==============================================
+# Shared resources
+# ==============================================
+# The latest index snapshot loads from embedding_store/ with no network calls;
+# only chunks whose content hash changed since the last build are re-embedded.
+# Use get_retrieval_engine().upsert(article) / .delete(doc_id) to edit the
+# knowledge base without a restart (see document_store.py).
+@process_singleton
+def get_retrieval_engine():
+    return RetrievalEngine(articles)
+
+# Intent detection runs locally (rules, then embedding centroids) and only
+# escalates to the LLM when the local tiers are below the confidence threshold.
+@process_singleton
+def get_intent_classifier():
+    return IntentClassifier(embed_fn=get_embedding)
+
+@process_singleton
+def get_pipeline_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="rag-retrieval")
+
+@process_singleton
+def get_context_manager():
+    return ContextManager()
+
+@process_singleton
+def get_response_cache():
+    return ResponseCache()
+
+# Conversation history for the API services, keyed by sender id
+@process_singleton
+def get_session_store():
+    return SessionStore()
+
+def remember_exchange(sender_id, user_message, reply):
+    """
+    Add a question/reply pair to the sender's history. Fallback replies are
+    not stored, so a retried message does not see its own failure.
+    """
+    if sender_id and reply and not any(reply.endswith(fallback) for fallback in FALLBACK_REPLIES):
+        get_session_store().append(sender_id, [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": reply},
+        ])
+
+# Rows are queued and written in batches by a background thread (see
+# sheets_logger.py), so logging never adds latency to a chat reply.
+@process_singleton
+def get_sheets_log_writer():
+    # google-auth is slow to import and only the first logged row needs it
+    from google_auth import authenticate_google_sheets
+    return SheetsLogWriter(authenticate_google_sheets)
+
+def warm_up():
+    """
+    Build the retrieval engine and intent classifier ahead of the first
+    request (services call this from a background thread at startup).
+    """
+    try:
+        get_retrieval_engine()
+        get_intent_classifier().classify_with_centroids("hello")  # embeds the labelled examples
+    except Exception as e:
+        print(f"[Chat Core] Warm-up failed: {e}")
+
+def log_to_google_sheets(data):
+    try:
+        return get_sheets_log_writer().log(data)
+
+    except Exception as e:
+        print(f"[Google Sheets Logging Error] {e}")
+        return False
+
+# ==============================================
+# Retrieval + prompt building
+# ==============================================
+def build_prompt_and_sources(user_query, k=4, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Build a prompt from the top-k relevant passages (article chunks), kept
+    within token_budget so prompts stay small. Passages below the similarity
+    cutoff are dropped, so an off-topic question gets no context section.
+    Returns (prompt, chunk_ids); the chunk ids key the response cache.
+    """
+    try:
+        passages = get_retrieval_engine().retrieve_passages(user_query, k, token_budget)
+    except Exception as e:
+        print(f"[Error] Failed to retrieve relevant articles: {e}")
+        passages = []
+
+    # Instructions live in the static prefix (prompts.py); this is only the variable tail
+    prompt = format_rag_message(user_query, passages)
+    sources = [p["id"] for p in passages]
+
+    return prompt, sources
+
+def build_prompt_with_context(user_query, k=4):
+    prompt, _ = build_prompt_and_sources(user_query, k)
+    return prompt
+
+# ==============================================
+# Intent detection (concurrent with retrieval)
+# ==============================================
+def detect_intent(user_input: str) -> str:
+    with timed("intent"):
+        return get_intent_classifier().classify(user_input).intent
+
+def detect_intent_and_retrieve(user_input, k=4):
+    """
+    Start building the RAG prompt in a worker thread while intent is detected
+    here, so the two network hops overlap. Returns (intent, prompt_future); on
+    handoff the retrieval is cancelled (or its result ignored if already running).
+    """
+    rag_future = get_pipeline_executor().submit(build_prompt_and_sources, user_input.strip(), k)
+    intent = detect_intent(user_input)
+    if intent == "handoff":
+        rag_future.cancel()
+    return intent, rag_future
+
+# ==============================================
+# Token-budgeted message assembly
+# ==============================================
+def build_chat_messages(user_messages, history=None, session_key=None):
+    """
+    System prompt + summary of older turns + recent history + the current user
+    message, fitted to the token budget (see context_manager.py). History is a
+    list of {"role", "content"} turns, oldest first, excluding user_messages.
+    Returns (messages, token_report).
+    """
+    # Static, byte-identical prefix first so the provider's prompt cache can reuse it
+    with timed("prompt_assembly"):
+        messages, token_report = get_context_manager().build(
+            static_prefix_messages(), list(history or []), user_messages, session_key=session_key
+        )
+    for part in ("system", "summary", "history", "user", "total"):
+        observe_tokens(part, token_report[part])
+    logging.debug("Prompt tokens: %s", token_report)
+    return messages, token_report
+
+# ==============================================
+# OpenAI Communication (uses Chat API)
+# ==============================================
+def _completion_slot_args(messages, session_key):
+    # Replies are user-facing; the scheduler shares slots fairly across sessions
+    return {"priority": INTERACTIVE, "session": session_key,
+            "tokens": count_message_tokens(messages) + REPLY_RESERVE}
+
+def _fallback_reply(error):
+    """
+    Log a failed completion and return the FALLBACK_REPLIES entry for it.
+    Call it from the except block, so unexpected errors log their traceback.
+    """
+    if isinstance(error, CircuitOpen):
+        logging.warning("OpenAI completions are failing; answering with the degraded reply.")
+        return DEGRADED_REPLY
+    if isinstance(error, (RateLimitError, SchedulerTimeout)):
+        logging.warning("Rate limit reached. Try again shortly.")
+        return RATE_LIMIT_REPLY
+    if isinstance(error, (OpenAIError, DeadlineExceeded)):
+        logging.error(f"OpenAI API error: {error}")
+        return OPENAI_ERROR_REPLY
+    logging.exception("Unexpected error occurred.")
+    return UNEXPECTED_ERROR_REPLY
+
+def complete_messages(messages, model=COMPLETION_MODEL, temperature=0, session_key=None):
+    """
+    One chat completion for fully assembled messages, paced by the shared
+    "chat" scheduler (rate_limiter.py) and retried/hedged within the
+    "completion" deadline (resilience.py). API errors are returned as one of
+    FALLBACK_REPLIES.
+    """
+    try:
+        if not os.getenv("OPENAI_API_KEY"):
+            return API_KEY_MISSING_REPLY
+
+        def attempt(timeout):
+            # A hedged attempt takes its own scheduler slot
+            with get_scheduler("chat").slot(**_completion_slot_args(messages, session_key), timeout=timeout), \
+                    timed("completion"):
+                return get_client(timeout=timeout, max_retries=0).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature
+                )
+
+        response = get_policy("completion").call(attempt)
+        record_usage(response.usage)
+
+        return response.choices[0].message.content
+
+    except Exception as e:
+        return _fallback_reply(e)
+
+def stream_messages(messages, model=COMPLETION_MODEL, temperature=0, session_key=None):
+    """
+    Same as complete_messages, but yields the reply in chunks so callers can
+    render from the first token. Errors are yielded as the reply text. The
+    scheduler slot is held until the stream ends. Opening the stream is
+    retried like a completion (never hedged); a stream that breaks midway is
+    not retried.
+    """
+    try:
+        if not os.getenv("OPENAI_API_KEY"):
+            yield API_KEY_MISSING_REPLY
+            return
+
+        policy = get_policy("completion")
+        with get_scheduler("chat").slot(**_completion_slot_args(messages, session_key), timeout=policy.deadline):
+            start = time.perf_counter()
+            stream = policy.call(lambda timeout: get_client(timeout=timeout, max_retries=0).chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True}  # final chunk carries token usage
+            ), hedge=False, sample=False)
+
+            first_token = True
+            for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        observe("completion_first_token", time.perf_counter() - start)
+                        first_token = False
+                    yield chunk.choices[0].delta.content
+            observe("completion", time.perf_counter() - start)
+
+    except Exception as e:
+        yield _fallback_reply(e)
+
+def get_completion_from_messages(user_messages, model=COMPLETION_MODEL, temperature=0, history=None, session_key=None):
+    messages, _ = build_chat_messages(user_messages, history, session_key)
+    return complete_messages(messages, model, temperature, session_key)
+
+# ==============================================
+# Async variant for the ASGI service (asgi_api.py)
+# ==============================================
+async def acomplete_messages(messages, model=COMPLETION_MODEL, temperature=0, session_key=None):
+    """
+    complete_messages on the async client, so a waiting completion holds no
+    worker thread (and a losing hedge is cancelled).
+    """
+    try:
+        if not os.getenv("OPENAI_API_KEY"):
+            return API_KEY_MISSING_REPLY
+
+        async def attempt(timeout):
+            async with get_scheduler("chat").aslot(**_completion_slot_args(messages, session_key), timeout=timeout):
+                with timed("completion"):
+                    return await get_async_client(timeout=timeout, max_retries=0).chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature
+                    )
+
+        response = await get_policy("completion").acall(attempt)
+        record_usage(response.usage)
+
+        return response.choices[0].message.content
+
+    except Exception as e:
+        return _fallback_reply(e)
+
+# ==============================================
+# Response cache (exact + semantic) for repeated questions
+# ==============================================
+def conversation_context(messages, user_messages):
+    """
+    Cache context for assembled messages: a hash of what sits between the
+    static prefix and user_messages (conversation summary and fitted history),
+    or "" when nothing does.
+    """
+    conversation = messages[len(static_prefix_messages()):len(messages) - len(user_messages)]
+    if not conversation:
+        return ""
+    raw = json.dumps([[m["role"], m["content"]] for m in conversation])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def lookup_cached_response(user_query, sources, model=COMPLETION_MODEL, context=""):
+    """
+    Returns (cached_reply or None, query_embedding) for the query and its sources
+    in the conversation context (see conversation_context).
+    The semantic tier only uses an embedding already computed for this query
+    (by retrieval or intent detection), so a lexical-only lookup stays offline.
+    While the completion circuit is open (resilience.py) a miss falls back to a
+    similar answer cached for any sources, then to DEGRADED_REPLY, so callers
+    answer at once instead of attempting a completion.
+    """
+    embedding = get_cached_embedding(user_query)
+    cache = get_response_cache()
+    reply = cache.get(user_query, model, sources, embedding, context)
+    if reply is None and get_policy("completion").breaker.is_open():
+        reply = cache.get_similar(model, embedding, context) or DEGRADED_REPLY
+    return reply, embedding
+
+def store_cached_response(user_query, sources, reply, embedding=None, model=COMPLETION_MODEL, context=""):
+    # A streamed reply that failed midway ends with the fallback text
+    if reply and not any(reply.endswith(fallback) for fallback in FALLBACK_REPLIES):
+        get_response_cache().put(user_query, model, sources, reply, embedding, context)
+
+# ==============================================
+# Reply pipeline shared by the API services (api.py, asgi_api.py)
+# ==============================================
+PreparedReply = namedtuple("PreparedReply", ["user_message", "sender_id", "messages", "context",
+                                             "sources", "embedding", "cached_reply"])
+
+def prepare_reply(user_message, sender_id=None):
+    """
+    Everything up to the completion: the sender's history, the RAG prompt,
+    the messages fitted to the token budget and a lookup in the response
+    cache (keyed on that conversation too). Complete prepared.messages only
+    when prepared.cached_reply is None, then call finish_reply.
+    """
+    history = get_session_store().get(sender_id) if sender_id else None
+    rag, sources = build_prompt_and_sources(user_message)
+    user_messages = [{"role": "user", "content": rag}]
+    messages, _ = build_chat_messages(user_messages, history, sender_id)
+    context = conversation_context(messages, user_messages)
+    cached_reply, embedding = lookup_cached_response(user_message, sources, context=context)
+    return PreparedReply(user_message, sender_id, messages, context, sources, embedding, cached_reply)
+
+def finish_reply(prepared, reply):
+    """
+    Cache a freshly completed reply and add the exchange to the sender's history.
+    """
+    if prepared.cached_reply is None:
+        store_cached_response(prepared.user_message, prepared.sources, reply, prepared.embedding,
+                              context=prepared.context)
+    remember_exchange(prepared.sender_id, prepared.user_message, reply)
+
+# ==============================================
+# Metrics
+# ==============================================
+def collect_stats():
+    """
+    Token usage, connection reuse and cache hit rates for this process, in
+    the {name: (help, values)} shape render_prometheus() takes.
+    """
+    return {
+        "chatbot_openai_usage": ("OpenAI token usage and prompt cache hit rate.", get_usage_stats()),
+        "chatbot_openai_connections": ("OpenAI HTTP requests and connection reuse.", get_client_stats()),
+        "chatbot_response_cache": ("Response cache hits, misses and hit rate.", get_response_cache().stats()),
+        "chatbot_embedding_cache": ("Embedding cache hits, misses and hit rate.", embedding_cache.stats()),
+        "chatbot_sessions": ("API conversation sessions and memory-tier hit rate.", get_session_store().stats()),
+        "chatbot_chat_scheduler": ("Chat request scheduler slots, queue and 429s.", get_scheduler("chat").stats()),
+        "chatbot_embedding_scheduler": ("Embedding request scheduler slots, queue and 429s.", get_scheduler("embeddings").stats()),
+        **{
+            f"chatbot_{kind}_resilience": (f"OpenAI {kind} call retries, hedges and circuit breaker.",
+                                           get_policy(kind).stats())
+            for kind in POLICY_DEFAULTS
+        },
+        **_google_auth_stats(),
+    }
+
+def _google_auth_stats():
+    # google_auth is imported lazily by get_sheets_log_writer; don't pull
+    # google-auth in just to report that no token was refreshed yet
+    google_auth = sys.modules.get("google_auth")
+    manager = google_auth.started_credential_manager() if google_auth is not None else None
+    if manager is None:
+        return {}
+    return {"chatbot_google_auth": ("Google OAuth token refreshes, failures and latency.", manager.stats())}
+
+def metrics_text():
+    return render_prometheus(collect_stats())
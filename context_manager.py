@@ -0,0 +1,221 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from openai_client import get_client, record_usage
+from ingestion import estimate_tokens
+from metrics import timed
+from rate_limiter import get_scheduler, BACKGROUND
+
+try:
+    import tiktoken
+except ImportError:  # in requirements.txt; without it, fall back to the ~4 chars/token estimate
+    tiktoken = None
+
+# ============================================================
+# Token-budgeted Conversation Context
+# ============================================================
+# Fits the system prompt, the current user message (which carries the
+# retrieved context) and as much recent history as possible into
+# CONTEXT_BUDGET_TOKENS, leaving CONTEXT_REPLY_RESERVE tokens for the reply.
+# Turns that no longer fit are folded into a running summary; room for it is
+# reserved before turns are fitted, so every turn is either sent or
+# summarized. The summary is cached per session together with the ids
+# (content fingerprints) of the last turns it covers, and extended only with
+# turns dropped after those, so it is not recomputed every turn even when the
+# number of dropped turns changes with the size of the retrieved context.
+# Summaries are updated in the background: a reply uses the last cached
+# summary and never waits on the summarization call.
+BUDGET_TOKENS = int(os.getenv("CONTEXT_BUDGET_TOKENS", "3000"))
+REPLY_RESERVE = int(os.getenv("CONTEXT_REPLY_RESERVE", "500"))
+SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-3.5-turbo-0125")
+MAX_SESSIONS = 1000
+SUMMARY_WORKERS = int(os.getenv("CONTEXT_SUMMARY_WORKERS", "2"))
+SUMMARY_QUEUE_TIMEOUT = float(os.getenv("CONTEXT_SUMMARY_QUEUE_TIMEOUT", "60"))
+MESSAGE_OVERHEAD_TOKENS = 4  # role/separator tokens per chat message
+SUMMARY_MAX_TOKENS = 200
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        _encoding = None
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return estimate_tokens(text)
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def turn_id(turn):
+    return hashlib.sha1(f"{turn['role']}\0{turn['content']}".encode("utf-8")).hexdigest()[:16]
+
+
+def summary_message(summary):
+    return {"role": "system", "content": SUMMARY_HEADER + summary}
+
+
+# Tokens kept free for the summary message (summarize_with_llm caps its length)
+SUMMARY_RESERVE_TOKENS = count_message_tokens([summary_message("")]) + SUMMARY_MAX_TOKENS
+
+
+def summarize_with_llm(previous_summary, turns, model=SUMMARY_MODEL):
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    prompt = (
+        "Update the running summary of a physiotherapy clinic chat with the new turns. "
+        "Keep symptoms, body regions, goals, contact preferences and open questions. "
+        "Reply with the summary only, under 120 words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    # Runs on the summary workers, never on a reply: background priority lets
+    # replies go first, and if no slot frees up the old summary is kept
+    with get_scheduler("chat").slot(BACKGROUND, tokens=count_tokens(prompt) + SUMMARY_MAX_TOKENS,
+                                    timeout=SUMMARY_QUEUE_TIMEOUT):
+        response = get_client(timeout=10).chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+    record_usage(response.usage)
+    return response.choices[0].message.content.strip()
+
+
+class ContextManager:
+    def __init__(self, budget_tokens=BUDGET_TOKENS, reply_reserve=REPLY_RESERVE, summarize_fn=summarize_with_llm):
+        self.budget_tokens = budget_tokens
+        self.reply_reserve = reply_reserve
+        self.summarize_fn = summarize_fn
+        self._lock = threading.Lock()
+        self._summaries = OrderedDict()  # session_key -> (ids of the last two summarized turns, summary)
+        self._pending = set()  # session keys with a summary update in flight
+        self._executor = None
+
+    @staticmethod
+    def _covered(history, through):
+        """
+        Number of leading history turns the summary covers: the position just
+        after its last summarized turn, or 0 if that turn is no longer in
+        history. Stored histories are trimmed from the front (see
+        session_store.trim_turns), so then every remaining turn is newer.
+        """
+        previous_id, last_id = through
+        for i in range(len(history) - 1, -1, -1):
+            if turn_id(history[i]) != last_id:
+                continue
+            if previous_id is None or i == 0 or turn_id(history[i - 1]) == previous_id:
+                return i + 1
+        return 0
+
+    def _cached_summary(self, session_key, history):
+        """
+        Return (through, summary, covered) for the session's cached summary;
+        an empty history means the conversation was reset, so it is forgotten.
+        """
+        with self._lock:
+            if not history:
+                self._summaries.pop(session_key, None)
+                return (None, None), "", 0
+            through, summary = self._summaries.get(session_key, ((None, None), ""))
+        return through, summary, self._covered(history, through) if summary else 0
+
+    def _refresh_summary(self, session_key, history, through, summary, covered, n_dropped):
+        """
+        If the summary is behind the first n_dropped history turns, schedule
+        a background update with only the turns it has not seen yet.
+        """
+        if covered < n_dropped and self.summarize_fn is not None:
+            new_through = (turn_id(history[n_dropped - 2]) if n_dropped > 1 else None, turn_id(history[n_dropped - 1]))
+            self._schedule_update(session_key, through, summary, history[covered:n_dropped], new_through)
+
+    def _schedule_update(self, session_key, through, summary, turns, new_through):
+        with self._lock:
+            if session_key in self._pending:
+                return
+            self._pending.add(session_key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="context-summary")
+        try:
+            self._executor.submit(self._update_summary, session_key, through, summary, turns, new_through)
+        except RuntimeError:  # interpreter shutting down
+            with self._lock:
+                self._pending.discard(session_key)
+
+    def _update_summary(self, session_key, through, summary, turns, new_through):
+        try:
+            with timed("summary"):
+                summary = self.summarize_fn(summary, turns)
+            with self._lock:
+                current = self._summaries.get(session_key)
+                if current is not None and current[0] != through:
+                    return  # the summary moved on meanwhile
+                self._summaries[session_key] = (new_through, summary)
+                self._summaries.move_to_end(session_key)
+                while len(self._summaries) > MAX_SESSIONS:
+                    self._summaries.popitem(last=False)
+        except Exception as e:
+            print(f"[Context] Summary update failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_key)
+
+    @staticmethod
+    def _fit(history, available):
+        """
+        The longest suffix of history that fits in available tokens.
+        """
+        kept = []
+        for message in reversed(history):
+            cost = count_message_tokens([message])
+            if cost > available:
+                break
+            kept.insert(0, message)
+            available -= cost
+        return kept
+
+    def build(self, system_messages, history, user_messages, session_key=None):
+        """
+        Return (messages, token_report). History is a list of
+        {"role", "content"} turns, oldest first, excluding user_messages.
+        """
+        budget = self.budget_tokens - self.reply_reserve
+        fixed_tokens = count_message_tokens(system_messages) + count_message_tokens(user_messages)
+        available = budget - fixed_tokens
+
+        kept = self._fit(history, available)
+        summary_messages, summarized = [], 0
+        if session_key is not None:
+            through, summary, covered = self._cached_summary(session_key, history)
+            # Also needed when everything fits but the summary covers turns
+            # already trimmed from the stored history
+            if len(kept) < len(history) or (summary and covered == 0):
+                # Reserve room for the summary first, so turns that make way for it are summarized too
+                kept = self._fit(history, available - SUMMARY_RESERVE_TOKENS)
+                n_dropped = len(history) - len(kept)
+                self._refresh_summary(session_key, history, through, summary, covered, n_dropped)
+                if summary:
+                    summary_messages = [summary_message(summary)]
+                summarized = min(covered, n_dropped)
+
+        messages = system_messages + summary_messages + kept + user_messages
+        report = {
+            "system": count_message_tokens(system_messages),
+            "summary": count_message_tokens(summary_messages),
+            "history": count_message_tokens(kept),
+            "history_turns": len(kept),
+            "summarized_turns": summarized,
+            "dropped_turns": len(history) - len(kept) - summarized,  # neither sent nor summarized
+            "user": count_message_tokens(user_messages),
+            "budget": budget,
+        }
+        report["total"] = report["system"] + report["summary"] + report["history"] + report["user"]
+        return messages, report
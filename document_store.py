@@ -0,0 +1,258 @@
+import os
+import shutil
+import hashlib
+import threading
+import contextlib
+import numpy as np
+import faiss
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: writers are then only serialized within one process
+    fcntl = None
+
+from embedding_store import STORE_DIR, DEFAULT_MODEL, content_hash, read_store, write_store, temp_path
+from index_factory import build_index
+from ingestion import chunk_articles, doc_id_for
+from bm25 import BM25Index
+
+# ============================================================
+# Document Store: incremental upsert/delete with versioned snapshots
+# ============================================================
+# Every change produces a new immutable IndexSnapshot. Unchanged chunks keep
+# their vectors (matched by content hash), so updating one FAQ embeds only its
+# changed chunks. The FAISS index is keyed by int64 chunk ids
+# (faiss.IndexIDMap2 or IVF ids), so changes are applied with
+# remove_ids/add_with_ids on a copy of the previous index. If the index type
+# cannot remove ids (HNSW), it is rebuilt from the stored vectors, which
+# needs no API calls.
+#
+# Snapshots are persisted as <store_dir>/snapshots/v<N>/ and <store_dir>/CURRENT
+# names the live version. Readers swap to a new snapshot atomically, and
+# other processes pick it up through refresh_if_changed(). Writers in any
+# process hold an flock on <store_dir>/LOCK and apply their change to the
+# latest published snapshot, so concurrent upserts never overwrite each other.
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+KEEP_SNAPSHOTS = int(os.getenv("DOCUMENT_STORE_KEEP_SNAPSHOTS", "3"))
+
+
+def chunk_int_id(chunk_id):
+    """
+    Stable int64 FAISS id for a chunk's string id.
+    """
+    return int(hashlib.sha1(chunk_id.encode("utf-8")).hexdigest()[:15], 16)
+
+
+class IndexSnapshot:
+    def __init__(self, version, chunks, vectors, index):
+        self.version = version
+        self.chunks = chunks  # row order == vectors row order
+        self.vectors = vectors
+        self.index = index
+        self.position_by_int_id = {chunk["int_id"]: pos for pos, chunk in enumerate(chunks)}
+        self.bm25 = BM25Index([f"{chunk['title']} {chunk['content']}" for chunk in chunks])
+
+    @property
+    def doc_ids(self):
+        return {chunk["doc_id"] for chunk in self.chunks}
+
+
+class DocumentStore:
+    def __init__(self, embed_fn, embed_batch_fn=None, store_dir=STORE_DIR, model=DEFAULT_MODEL):
+        self.embed_fn = embed_fn
+        self.embed_batch_fn = embed_batch_fn
+        self.store_dir = store_dir
+        self.model = model
+        self._write_lock = threading.Lock()
+        self.snapshot = None
+        self.load()
+
+    # ---------- persistence ----------
+    def _version_dir(self, version):
+        return os.path.join(self.store_dir, SNAPSHOTS_DIR, f"v{version:06d}")
+
+    def _read_current_version(self):
+        try:
+            with open(os.path.join(self.store_dir, CURRENT_FILE), encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def load(self):
+        """
+        Load the snapshot named by CURRENT (no network calls). Returns True if
+        a snapshot was loaded.
+        """
+        version = self._read_current_version()
+        if version is None:
+            return False
+        stored = read_store(self._version_dir(version), model=self.model)
+        if stored is None:
+            return False
+        entries, vectors, index = stored
+        self.snapshot = IndexSnapshot(version, entries, vectors, index)
+        return True
+
+    def refresh_if_changed(self):
+        """
+        Hot-swap to a newer snapshot published by another process.
+        """
+        version = self._read_current_version()
+        current = self.snapshot.version if self.snapshot else None
+        if version is not None and version != current:
+            return self.load()
+        return False
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Serialize writers across threads and, through the lock file, across
+        processes sharing the store directory.
+        """
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.store_dir, exist_ok=True)
+            with open(os.path.join(self.store_dir, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _publish(self, snapshot):
+        write_store(self._version_dir(snapshot.version), snapshot.vectors, snapshot.chunks,
+                    snapshot.index, model=self.model)
+        current_path = os.path.join(self.store_dir, CURRENT_FILE)
+        tmp_path = temp_path(current_path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(snapshot.version))
+        os.replace(tmp_path, current_path)
+        self.snapshot = snapshot
+
+        for old_version in range(snapshot.version - KEEP_SNAPSHOTS, 0, -1):
+            old_dir = self._version_dir(old_version)
+            if not os.path.isdir(old_dir):
+                break
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    # ---------- mutations ----------
+    def _embed(self, texts):
+        if self.embed_batch_fn is not None:
+            vectors = self.embed_batch_fn(texts, model=self.model)
+        else:
+            vectors = [self.embed_fn(text, model=self.model) for text in texts]
+        vectors = np.array(vectors, dtype="float32").reshape(len(texts), -1)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def _prepare_chunks(self, article):
+        chunks = []
+        for chunk in chunk_articles([article]):
+            chunk.pop("article_index", None)
+            chunk["hash"] = content_hash(chunk["content"], self.model)
+            chunk["int_id"] = chunk_int_id(chunk["id"])
+            chunks.append(chunk)
+        return chunks
+
+    def _apply(self, upserts, deletes, replace_all=False):
+        """
+        Publish a snapshot with upserts added and deletes removed (with
+        replace_all, every document not in upserts). Returns the number of
+        chunks embedded.
+        """
+        with self._locked():
+            # Another process may have published since this one loaded
+            self.refresh_if_changed()
+            old = self.snapshot
+            if replace_all:
+                deletes = (old.doc_ids if old else set()) - {doc_id_for(article) for article in upserts}
+            old_chunks = old.chunks if old else []
+            old_pos_by_id = {chunk["int_id"]: pos for pos, chunk in enumerate(old_chunks)}
+            old_pos_by_hash = {chunk["hash"]: pos for pos, chunk in enumerate(old_chunks)}
+
+            touched = {doc_id_for(article) for article in upserts} | set(deletes)
+            kept = [chunk for chunk in old_chunks if chunk["doc_id"] not in touched]
+            new_chunks = [chunk for article in upserts for chunk in self._prepare_chunks(article)]
+
+            unchanged, added = set(), []
+            for chunk in new_chunks:
+                pos = old_pos_by_id.get(chunk["int_id"])
+                if pos is not None and old_chunks[pos]["hash"] == chunk["hash"]:
+                    unchanged.add(chunk["int_id"])
+                else:
+                    added.append(chunk)
+            removed = [c["int_id"] for c in old_chunks if c["doc_id"] in touched and c["int_id"] not in unchanged]
+            if old is not None and not removed and not added:
+                return 0
+
+            # Only text never seen before costs an embedding call
+            to_embed = list({c["hash"]: c for c in added if c["hash"] not in old_pos_by_hash}.values())
+            embedded = self._embed([c["content"] for c in to_embed]) if to_embed else None
+            embedded_rows = {c["hash"]: row for row, c in enumerate(to_embed)}
+
+            def vector_for(chunk):
+                if chunk["hash"] in embedded_rows:
+                    return embedded[embedded_rows[chunk["hash"]]]
+                return old.vectors[old_pos_by_hash[chunk["hash"]]]
+
+            final_chunks = kept + new_chunks
+            if not final_chunks:
+                raise ValueError("The document store cannot be empty.")
+            vectors = np.vstack([vector_for(c) for c in final_chunks]).astype("float32")
+
+            index = None
+            if old is not None:
+                try:
+                    index = faiss.clone_index(old.index)
+                    if removed:
+                        index.remove_ids(faiss.IDSelectorBatch(np.array(removed, dtype="int64")))
+                    if added:
+                        rows = np.vstack([vector_for(c) for c in added]).astype("float32")
+                        index.add_with_ids(rows, np.array([c["int_id"] for c in added], dtype="int64"))
+                except RuntimeError:
+                    index = None  # index type cannot remove ids; rebuild locally
+            if index is None:
+                ids = np.array([c["int_id"] for c in final_chunks], dtype="int64")
+                index = build_index(vectors, metric=faiss.METRIC_INNER_PRODUCT, ids=ids)
+
+            version = max(old.version if old else 0, self._read_current_version() or 0) + 1
+            self._publish(IndexSnapshot(version, final_chunks, vectors, index))
+            print(f"[Document Store] v{version}: {len(final_chunks)} chunks, "
+                  f"{len(to_embed)} embedded, {len(removed)} removed.")
+            return len(to_embed)
+
+    def upsert(self, article):
+        """
+        Add or replace one article (matched by id or title slug). Returns the
+        number of chunks that needed an embedding call.
+        """
+        return self._apply([article], [])
+
+    def delete(self, doc_id):
+        self.refresh_if_changed()
+        if self.snapshot is None or doc_id not in self.snapshot.doc_ids:
+            return 0
+        self._apply([], [doc_id])
+        return 1
+
+    def sync(self, articles):
+        """
+        Make the store match the article list exactly, embedding only chunks
+        whose content hash is new.
+        """
+        valid = [a for a in articles if a.get("content") and isinstance(a["content"], str) and a["content"].strip()]
+        return self._apply(valid, [], replace_all=True)
+
+
+if __name__ == "__main__":
+    # Offline build/sync of the knowledge base: `python document_store.py`
+    from dotenv import load_dotenv, find_dotenv
+    from knowledge_base import articles
+    from embeddings import get_embedding, get_embeddings
+
+    _ = load_dotenv(find_dotenv())
+    DocumentStore(get_embedding, embed_batch_fn=get_embeddings).sync(articles)
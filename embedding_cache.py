@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+# ============================================================
+# Query Embedding LRU Cache
+# ============================================================
+# Memoizes get_embedding() on (model, normalized text). Vectors are stored as
+# read-only float32 arrays and evicted least-recently-used once the cache holds
+# more than EMBEDDING_CACHE_MAX_BYTES. Concurrent misses for the same key share
+# one API call. Set EMBEDDING_CACHE_FILE to persist the cache between restarts.
+MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE", "")
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class EmbeddingCache:
+    def __init__(self, max_bytes=MAX_BYTES, cache_file=CACHE_FILE):
+        self.max_bytes = max_bytes
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (model, text) -> float32 array
+        self._inflight = {}  # (model, text) -> Future
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_misses = 0
+        if cache_file:
+            self.load()
+            atexit.register(self.save)
+
+    def _store(self, key, vector):
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key).nbytes
+        self._entries[key] = vector
+        self.nbytes += vector.nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def get_or_compute(self, model, text, compute_fn):
+        """
+        Return the cached embedding, or call compute_fn(text, model) once even
+        if several threads miss on the same key at the same time.
+        """
+        key = (model, normalize_text(text))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.shared_misses += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            vector = np.array(compute_fn(key[1], model), dtype="float32")
+            vector.setflags(write=False)
+        except BaseException as e:
+            future.set_exception(e)
+            with self._lock:
+                self._inflight.pop(key, None)
+            raise
+
+        with self._lock:
+            self._store(key, vector)
+            self._inflight.pop(key, None)
+        future.set_result(vector)
+        return vector
+
+    def peek(self, model, text):
+        """
+        Return the cached embedding without computing it, or None.
+        """
+        key = (model, normalize_text(text))
+        with self._lock:
+            return self._entries.get(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.shared_misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_misses": self.shared_misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def save(self, path=None):
+        path = path or self.cache_file
+        if not path:
+            return
+        with self._lock:
+            keys = [list(key) for key in self._entries]
+            vectors = list(self._entries.values())
+        data = np.concatenate(vectors) if vectors else np.zeros(0, dtype="float32")
+        lengths = np.array([len(v) for v in vectors], dtype="int64")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(json.dumps(keys)), lengths=lengths, data=data)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        path = path or self.cache_file
+        if not path or not os.path.isfile(path):
+            return
+        try:
+            with np.load(path) as saved:
+                keys = json.loads(str(saved["keys"]))
+                lengths = saved["lengths"]
+                data = saved["data"].astype("float32")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Embedding Cache] Ignoring unreadable cache file: {e}")
+            return
+        offset = 0
+        with self._lock:
+            for key, length in zip(keys, lengths):
+                vector = data[offset:offset + length].copy()
+                vector.setflags(write=False)
+                self._store(tuple(key), vector)
+                offset += length
@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import faiss
+
+from index_factory import set_search_params
+
+# ============================================================
+# On-disk Embedding Store + Prebuilt FAISS Index
+# ============================================================
+# Layout of one store directory (document_store.py keeps one per snapshot
+# version under <EMBEDDING_STORE_DIR>/snapshots/):
+#   embeddings.npy  - L2-normalized float32 matrix, one row per chunk
+#                     (memory-mapped on load)
+#   manifest.json   - model, dimension, metric and every chunk (id, content
+#                     hash, text) in row order
+#   index.faiss     - serialized FAISS index over embeddings.npy, keyed by the
+#                     chunks' int64 ids
+#
+# Loading a store makes zero network calls.
+STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "embedding_store")
+EMBEDDINGS_FILE = "embeddings.npy"
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+DEFAULT_MODEL = "text-embedding-3-small"
+# Rows are unit vectors searched by inner product, i.e. cosine similarity
+METRIC = "ip"
+
+
+def content_hash(text, model=DEFAULT_MODEL):
+    """
+    Stable key for a chunk's embedding: the model name plus the stripped text.
+    """
+    return hashlib.sha256(f"{model}\n{text.strip()}".encode("utf-8")).hexdigest()
+
+
+def load_manifest(store_dir):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[Embedding Store] Ignoring unreadable manifest: {e}")
+        return None
+
+
+def temp_path(path):
+    """
+    Writer-unique temporary name next to path, so concurrent writers never
+    share a half-written file.
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _atomic_write(path, write_fn):
+    tmp_path = temp_path(path)
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_store(store_dir, embeddings_np, entries, index, model=DEFAULT_MODEL):
+    """
+    Persist one store directory. The manifest is written last, so a reader
+    never sees a manifest without its embeddings and index.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    def _write_embeddings(p):
+        with open(p, "wb") as f:
+            np.save(f, embeddings_np)
+
+    def _write_manifest(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "dim": int(embeddings_np.shape[1]), "metric": METRIC,
+                       "entries": entries}, f, indent=2)
+
+    _atomic_write(os.path.join(store_dir, EMBEDDINGS_FILE), _write_embeddings)
+    _atomic_write(os.path.join(store_dir, INDEX_FILE), lambda p: faiss.write_index(index, p))
+    _atomic_write(os.path.join(store_dir, MANIFEST_FILE), _write_manifest)
+
+
+def read_store(store_dir, model=DEFAULT_MODEL):
+    """
+    Return (entries, embeddings_np, index) for a complete store built with the
+    same model and metric, or None if it is missing, stale or unreadable.
+    """
+    manifest = load_manifest(store_dir)
+    if not manifest or manifest.get("model") != model or manifest.get("metric") != METRIC:
+        return None
+    try:
+        embeddings_np = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        index = faiss.read_index(os.path.join(store_dir, INDEX_FILE))
+    except Exception as e:
+        print(f"[Embedding Store] Failed to load {store_dir}: {e}")
+        return None
+    entries = manifest.get("entries", [])
+    if index.ntotal != len(entries) or len(embeddings_np) != len(entries):
+        return None
+    return entries, embeddings_np, set_search_params(index)
@@ -0,0 +1,125 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from openai_client import get_client
+from embedding_cache import EmbeddingCache
+from ingestion import estimate_tokens
+from rate_limiter import get_scheduler, INTERACTIVE, BACKGROUND
+from resilience import get_policy
+
+# Process-wide memo of query embeddings (see embedding_cache.py)
+embedding_cache = EmbeddingCache()
+
+# ============================================================
+# Embedding Function Using the Shared Client
+# ============================================================
+def _fetch_embedding(text, model):
+    def attempt(timeout):
+        # Query embeddings are user-facing: they go ahead of corpus builds
+        with get_scheduler("embeddings").slot(INTERACTIVE, tokens=estimate_tokens(text), timeout=timeout):
+            return get_client(timeout=timeout, max_retries=0).embeddings.create(
+                input=text,
+                model=model
+            )
+
+    # Retried, hedged and circuit-broken per the "embedding" policy (resilience.py)
+    response = get_policy("embedding").call(attempt)
+    return np.array(response.data[0].embedding, dtype="float32")
+
+def get_embedding(text, model="text-embedding-3-small"):
+    """
+    Generate a numeric embedding for a given text using OpenAI's new SDK (v1.x).
+    Results are cached, so repeated text costs no API call; the returned
+    float32 array is read-only.
+    """
+    if not text or not isinstance(text, str) or not text.strip():
+        raise ValueError("Text for embedding must be a non-empty string.")
+
+    return embedding_cache.get_or_compute(model, text, _fetch_embedding)
+
+def get_cached_embedding(text, model="text-embedding-3-small"):
+    """
+    Return the embedding only if it is already cached; never calls the API.
+    """
+    if not text or not isinstance(text, str):
+        return None
+    return embedding_cache.peek(model, text)
+
+# ============================================================
+# Batch Embeddings for Corpus Builds
+# ============================================================
+# Inputs are packed into requests up to EMBED_BATCH_MAX_INPUTS texts and
+# EMBED_BATCH_MAX_TOKENS tokens, and up to EMBED_CONCURRENCY requests run at
+# once as BACKGROUND work on the shared "embeddings" scheduler
+# (rate_limiter.py), which paces them to the requests/min and tokens/min limits.
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "2048"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "250000"))
+EMBED_MAX_INPUT_TOKENS = 8191
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBEDDING_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+def pack_batches(texts, max_inputs=EMBED_BATCH_MAX_INPUTS, max_tokens=EMBED_BATCH_MAX_TOKENS):
+    """
+    Group text positions into batches that respect the per-request input and
+    token limits. Returns a list of (positions, token_estimate).
+    """
+    batches, positions, tokens = [], [], 0
+    for i, text in enumerate(texts):
+        cost = min(estimate_tokens(text), EMBED_MAX_INPUT_TOKENS)
+        if positions and (len(positions) >= max_inputs or tokens + cost > max_tokens):
+            batches.append((positions, tokens))
+            positions, tokens = [], 0
+        positions.append(i)
+        tokens += cost
+    if positions:
+        batches.append((positions, tokens))
+    return batches
+
+def get_embeddings(texts, model="text-embedding-3-small", concurrency=EMBED_CONCURRENCY):
+    """
+    Embed many texts for a corpus build (bypasses the query cache). Batches run
+    concurrently and write straight into a preallocated float32 matrix with one
+    row per input text.
+    """
+    cleaned = []
+    for text in texts:
+        if not text or not isinstance(text, str) or not text.strip():
+            raise ValueError("Text for embedding must be a non-empty string.")
+        # Over-long inputs are cut to the model's per-input limit (~4 chars/token)
+        cleaned.append(text.strip()[:EMBED_MAX_INPUT_TOKENS * 4])
+
+    batches = pack_batches(cleaned)
+    if not batches:
+        return np.zeros((0, EMBEDDING_DIMS.get(model, 0)), dtype="float32")
+
+    client = get_client()
+    matrix = None
+    matrix_lock = threading.Lock()
+
+    def run_batch(batch):
+        nonlocal matrix
+        positions, tokens = batch
+        with get_scheduler("embeddings").slot(BACKGROUND, session="corpus", tokens=tokens):
+            response = client.embeddings.create(input=[cleaned[i] for i in positions], model=model)
+        with matrix_lock:
+            if matrix is None:
+                dim = EMBEDDING_DIMS.get(model) or len(response.data[0].embedding)
+                matrix = np.empty((len(cleaned), dim), dtype="float32")
+        for item in response.data:
+            matrix[positions[item.index]] = item.embedding
+
+    if len(batches) == 1 or concurrency <= 1:
+        for batch in batches:
+            run_batch(batch)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed-batch") as pool:
+            for future in [pool.submit(run_batch, batch) for batch in batches]:
+                future.result()
+
+    return matrix
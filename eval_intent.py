@@ -0,0 +1,101 @@
+import sys
+import time
+import argparse
+from dotenv import load_dotenv, find_dotenv
+
+from intent_classifier import IntentClassifier, classify_with_rules, classify_with_llm
+
+# ============================================================
+# Intent Classifier Evaluation
+# ============================================================
+# Usage:
+#   python eval_intent.py                 # rules tier only, no network
+#   python eval_intent.py --embeddings    # rules + centroid tier
+#   python eval_intent.py --llm           # also score the LLM baseline and the
+#                                         # full tiered classifier against it
+LABELLED_MESSAGES = [
+    ("Can I talk to a real person please", "handoff"),
+    ("I want to speak with a physiotherapist", "handoff"),
+    ("is there a human I can chat to", "handoff"),
+    ("please call me tomorrow morning", "handoff"),
+    ("connect me to live chat", "handoff"),
+    ("I'd like a consultant to contact me", "handoff"),
+    ("Could someone call me about my shoulder?", "handoff"),
+    ("Can someone get back to me?", "handoff"),
+    ("hello!", "general"),
+    ("Hi, how are you?", "general"),
+    ("thanks", "general"),
+    ("My lower back is stiff in the mornings", "general"),
+    ("Do you treat sports injuries?", "general"),
+    ("What should I expect after ACL surgery?", "general"),
+    ("how do I book a session", "general"),
+    ("what are your opening hours", "general"),
+    ("What do you call the pain under the kneecap?", "general"),
+    ("I have a referral from my GP", "general"),
+    ("Which muscles in the human shoulder cause this pain?", "general"),
+    ("My consultant referred me to you for knee rehab", "general"),
+    ("Can I talk to a friend about exercises?", "general"),
+    ("what's the capital of France", "other"),
+    ("write a haiku about spring", "other"),
+    ("can you recommend a good laptop", "other"),
+    ("tell me a joke", "other"),
+]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(name, classify_fn, messages=LABELLED_MESSAGES, reference=None):
+    correct, agree, latencies, sources, predictions = 0, 0, [], {}, []
+    for i, (text, label) in enumerate(messages):
+        start = time.perf_counter()
+        result = classify_fn(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+        predictions.append(result.intent)
+        sources[result.source] = sources.get(result.source, 0) + 1
+        correct += result.intent == label
+        if reference is not None:
+            agree += result.intent == reference[i]
+
+    n = len(messages)
+    print(f"{name}:")
+    print(f"  accuracy      {correct / n:.1%} ({correct}/{n})")
+    if reference is not None:
+        print(f"  agreement     {agree / n:.1%} with LLM baseline")
+    print(f"  latency ms    mean {sum(latencies) / n:.2f}  p50 {_percentile(latencies, 50):.2f}  p95 {_percentile(latencies, 95):.2f}")
+    print(f"  answered by   {sources}")
+    return predictions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the intent classifier tiers.")
+    parser.add_argument("--embeddings", action="store_true", help="enable the centroid tier")
+    parser.add_argument("--llm", action="store_true", help="score the LLM baseline too")
+    parser.add_argument("--threshold", type=float, default=0.75)
+    args = parser.parse_args(argv)
+
+    _ = load_dotenv(find_dotenv())
+
+    evaluate("rules only", classify_with_rules)
+
+    embed_fn = None
+    if args.embeddings:
+        from embeddings import get_embedding
+        embed_fn = get_embedding
+        local = IntentClassifier(threshold=args.threshold, embed_fn=embed_fn, llm_fn=None)
+        evaluate("rules + centroid", local.classify)
+
+    if args.llm:
+        baseline = evaluate("LLM baseline", classify_with_llm)
+        tiered = IntentClassifier(threshold=args.threshold, embed_fn=embed_fn)
+        evaluate("tiered (escalates to LLM)", tiered.classify, reference=baseline)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
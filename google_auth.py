@@ -0,0 +1,134 @@
+import os
+import time
+import datetime
+import threading
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from gspread.auth import authorize
+
+# ============================================================
+# Cached Google OAuth Credentials + gspread Client
+# ============================================================
+# Access tokens last about an hour, so the token is refreshed only when it is
+# within GOOGLE_REFRESH_MARGIN seconds of expiry. A background timer refreshes
+# it ahead of time so requests normally never wait on the token endpoint.
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+REFRESH_MARGIN = float(os.getenv("GOOGLE_REFRESH_MARGIN", "300"))
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+class GoogleCredentialManager:
+    def __init__(self, refresh_margin=REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._creds = None
+        self._client = None
+        self._timer = None
+        self.refresh_count = 0
+        self.refresh_failures = 0
+        self.refresh_seconds_total = 0.0
+        self.last_refresh_seconds = 0.0
+
+    def _build_credentials(self):
+        return Credentials(
+            None,
+            refresh_token=os.getenv("GOOGLE_REFRESH_TOKEN"),
+            token_uri=os.getenv("GOOGLE_TOKEN_URI"),
+            client_id=os.getenv("GOOGLE_CLIENT_ID"),
+            client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+            scopes=SCOPES
+        )
+
+    def _seconds_to_expiry(self):
+        if self._creds is None or not self._creds.token or self._creds.expiry is None:
+            return 0.0
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (self._creds.expiry - now).total_seconds()
+
+    def _needs_refresh(self):
+        return self._seconds_to_expiry() <= self.refresh_margin
+
+    def _refresh_locked(self):
+        if self._creds is None:
+            self._creds = self._build_credentials()
+        start = time.perf_counter()
+        try:
+            self._creds.refresh(Request())
+        except Exception:
+            self.refresh_failures += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.last_refresh_seconds = elapsed
+            self.refresh_seconds_total += elapsed
+        self.refresh_count += 1
+        if self._client is None:
+            # The gspread session holds a reference to the same Credentials
+            # object, so later in-place refreshes are picked up automatically.
+            self._client = authorize(self._creds)
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._seconds_to_expiry() - self.refresh_margin, 30.0)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._refresh_locked()
+        except Exception as e:
+            print(f"[Google Auth] Background token refresh failed: {e}")
+            with self._lock:
+                self._timer = threading.Timer(60.0, self._background_refresh)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def get_client(self):
+        """
+        Return the cached gspread client, refreshing the token only near expiry.
+        """
+        with self._lock:
+            if self._client is None or self._needs_refresh():
+                self._refresh_locked()
+            return self._client
+
+    def stats(self):
+        with self._lock:
+            return {
+                "refresh_count": self.refresh_count,
+                "refresh_failures": self.refresh_failures,
+                "refresh_seconds_total": self.refresh_seconds_total,
+                "refresh_seconds_avg": (self.refresh_seconds_total / self.refresh_count) if self.refresh_count else 0.0,
+                "last_refresh_seconds": self.last_refresh_seconds,
+                "seconds_to_expiry": self._seconds_to_expiry(),
+            }
+
+
+def get_credential_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = GoogleCredentialManager()
+    return _manager
+
+
+def started_credential_manager():
+    """
+    The manager if one was created, without creating it (for stats).
+    """
+    return _manager
+
+
+def authenticate_google_sheets():
+    return get_credential_manager().get_client()
@@ -0,0 +1,137 @@
+import os
+import math
+import time
+import numpy as np
+import faiss
+
+# ============================================================
+# FAISS Index Factory (Flat / IVF-Flat / HNSW / IVF-PQ)
+# ============================================================
+# build_index() picks an index type from corpus size and memory budget:
+#   < FLAT_MAX_VECTORS                 -> Flat (exact)
+#   fits in memory, < HNSW_MAX_VECTORS -> HNSW
+#   fits in memory                     -> IVF-Flat
+#   larger than the memory budget      -> IVF-PQ (compressed)
+# Override with FAISS_INDEX_KIND=flat|hnsw|ivf|ivfpq. Search-time knobs:
+# FAISS_NPROBE (IVF lists probed) and FAISS_EF_SEARCH (HNSW candidate list).
+INDEX_KIND = os.getenv("FAISS_INDEX_KIND", "auto")
+MEMORY_BUDGET_MB = float(os.getenv("FAISS_MEMORY_BUDGET_MB", "1024"))
+NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FLAT_MAX_VECTORS = 10_000
+HNSW_MAX_VECTORS = 200_000
+HNSW_M = 32
+PQ_BITS = 8
+
+
+def choose_index_kind(n_vectors, dim, memory_budget_mb=MEMORY_BUDGET_MB):
+    raw_mb = n_vectors * dim * 4 / (1024 * 1024)
+    if n_vectors < FLAT_MAX_VECTORS:
+        return "flat"
+    if raw_mb > memory_budget_mb:
+        return "ivfpq"
+    # HNSW stores the raw vectors plus ~2*M neighbour links per vector
+    hnsw_mb = raw_mb + n_vectors * HNSW_M * 2 * 4 / (1024 * 1024)
+    if n_vectors < HNSW_MAX_VECTORS and hnsw_mb <= memory_budget_mb:
+        return "hnsw"
+    return "ivf"
+
+
+def _nlist_for(n_vectors):
+    # ~4*sqrt(n) lists, with at least ~39 training points per list
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def _pq_subquantizers(dim):
+    for m in (64, 48, 32, 24, 16, 8, 4, 2, 1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def set_search_params(index, nprobe=NPROBE, ef_search=EF_SEARCH):
+    """
+    Apply search-time tuning knobs to whichever index type this is.
+    """
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe, base.nlist)
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    return index
+
+
+def build_index(vectors, metric=faiss.METRIC_L2, kind=INDEX_KIND, memory_budget_mb=MEMORY_BUDGET_MB, ids=None):
+    """
+    Build, train and fill an index for the float32 vectors. With ids (int64,
+    one per row) the index is searchable and removable by those ids.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, dim = vectors.shape
+    if kind == "auto":
+        kind = choose_index_kind(n_vectors, dim, memory_budget_mb)
+
+    if kind == "flat":
+        index = faiss.IndexFlat(dim, metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+    elif kind == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlat(dim, metric), dim, _nlist_for(n_vectors), metric)
+    elif kind == "ivfpq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlat(dim, metric), dim, _nlist_for(n_vectors),
+                                 _pq_subquantizers(dim), PQ_BITS, metric)
+    else:
+        raise ValueError(f"Unknown FAISS index kind: {kind}")
+
+    if not index.is_trained:
+        index.train(vectors)
+    if ids is None:
+        index.add(vectors)
+    elif isinstance(index, faiss.IndexIVF):
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    else:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    return set_search_params(index)
+
+
+def recall_at_k(index, vectors, queries, k=10, metric=faiss.METRIC_L2):
+    """
+    Fraction of the exact (flat) top-k neighbours that the index also returns,
+    plus mean search latency in milliseconds.
+    """
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    flat = faiss.IndexFlat(vectors.shape[1], metric)
+    flat.add(np.ascontiguousarray(vectors, dtype="float32"))
+    k = min(k, flat.ntotal)
+    _, expected = flat.search(queries, k)
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / (len(queries) * k), latency_ms
+
+
+if __name__ == "__main__":
+    # Recall report for the stored embeddings: `python index_factory.py [kind ...]`
+    import sys
+    from document_store import DocumentStore
+
+    # Loads the snapshot named by CURRENT; no embedding calls
+    snapshot = DocumentStore(embed_fn=None).snapshot
+    if snapshot is None:
+        sys.exit("No embedding store snapshot found; build one with `python document_store.py`.")
+    vectors = np.ascontiguousarray(snapshot.vectors, dtype="float32")
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=min(100, len(vectors)), replace=False)]
+    queries = queries + rng.normal(scale=0.01, size=queries.shape).astype("float32")
+    for kind in sys.argv[1:] or ["flat", "hnsw", "ivf", "ivfpq"]:
+        try:
+            index = build_index(vectors, metric=faiss.METRIC_INNER_PRODUCT, kind=kind)
+        except Exception as e:
+            print(f"{kind:6s} skipped: {e}")
+            continue
+        recall, latency_ms = recall_at_k(index, vectors, queries, metric=faiss.METRIC_INNER_PRODUCT)
+        print(f"{kind:6s} recall@10 {recall:.3f}  {latency_ms:.3f} ms/query")
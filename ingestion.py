@@ -0,0 +1,78 @@
+import re
+import math
+
+# ============================================================
+# Document Ingestion: split articles into overlapping chunks
+# ============================================================
+# Retrieval works on passages rather than whole articles, so a prompt carries
+# only the relevant part of a long document. Each chunk keeps a back-pointer to
+# its source article and a stable id ("<doc_id>#<n>") that survives re-ingestion
+# as long as the article text before it does not change.
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+
+
+def estimate_tokens(text):
+    """
+    Cheap local token estimate (~4 characters per token for English text).
+    """
+    return math.ceil(len(text) / 4)
+
+
+def doc_id_for(article):
+    if article.get("id"):
+        return str(article["id"])
+    slug = re.sub(r"[^a-z0-9]+", "-", article.get("title", "").lower()).strip("-")
+    return slug or "untitled"
+
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = text.split()
+    if not words:
+        return []
+    step = max(chunk_words - overlap, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def chunk_articles(articles, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Return a flat list of chunk dicts:
+    {"id", "doc_id", "article_index", "title", "content"}.
+    """
+    chunks = []
+    for article_index, article in enumerate(articles):
+        content = article.get("content")
+        if not content or not isinstance(content, str) or not content.strip():
+            continue
+        doc_id = doc_id_for(article)
+        for n, passage in enumerate(chunk_text(content, chunk_words, overlap)):
+            chunks.append({
+                "id": f"{doc_id}#{n}",
+                "doc_id": doc_id,
+                "article_index": article_index,
+                "title": article.get("title", ""),
+                "content": passage,
+            })
+    return chunks
+
+
+def select_passages(chunks, token_budget):
+    """
+    Keep chunks in rank order until the token budget is used up. The first
+    chunk is always kept (truncated if needed) so a relevant hit is not lost.
+    """
+    selected, used = [], 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk["content"])
+        if used + cost > token_budget:
+            if not selected:
+                selected.append(dict(chunk, content=chunk["content"][:token_budget * 4]))
+            break
+        selected.append(chunk)
+        used += cost
+    return selected
@@ -0,0 +1,192 @@
+import re
+import threading
+from collections import namedtuple
+import numpy as np
+
+from openai_client import get_client, record_usage
+from rate_limiter import get_scheduler, INTERACTIVE
+from resilience import get_policy
+
+# ============================================================
+# Local Intent Classifier (handoff / general / other)
+# ============================================================
+# Tiers, cheapest first; each returns a confidence in [0, 1]:
+#   1. rules      - LIVE_CHAT_KEYWORDS, handoff phrases, greetings, clinic terms
+#   2. centroid   - nearest labelled-example centroid by embedding cosine
+#   3. llm        - the original chat-completion classifier
+# A tier's answer is used once its confidence reaches the threshold; the LLM is
+# only called when the local tiers are unsure.
+INTENTS = ("handoff", "general", "other")
+
+IntentResult = namedtuple("IntentResult", ["intent", "confidence", "source"])
+
+LIVE_CHAT_KEYWORDS = [
+    "speak", "talk", "call", "consultant", "real person", "human", "live chat", "contact someone"
+]
+# Word-boundary matches; on their own these words are often not a handoff
+# ("the human shoulder", "my consultant referred me"), so they only ever give
+# a low-confidence guess that escalates to the next tier.
+AMBIGUOUS_HANDOFF_PATTERN = re.compile(r"\b(" + "|".join(re.escape(k) for k in LIVE_CHAT_KEYWORDS) + r")\b")
+
+# Explicit requests for a person; these alone are confident enough to skip the LLM
+HANDOFF_PATTERNS = [re.compile(p) for p in [
+    r"\b(speak|talk|chat)\s+(to|with)\s+(a\s+|an\s+|the\s+|your\s+)?(real\s+|live\s+|actual\s+)?"
+    r"(person|human|someone|somebody|therapist|physio\w*|clinician|consultant|staff|team|receptionist)\b",
+    r"\b(a|an|the)\s+(real|actual|live)\s+(person|human)\b",
+    r"\b(is there|get me|want|need|prefer)\s+(a|an)\s+(real\s+|actual\s+)?(human|person)\b",
+    r"\blive (chat|agent|person)\b",
+    r"\bcontact someone\b",
+    r"\b(call|phone|ring|contact) me\b",
+    r"\b(can|could|will|would) (someone|somebody|you) (please )?(call|phone|ring|contact|get back to) me\b",
+    r"\bget back to me\b",
+    r"\bconnect me (to|with)\b",
+]]
+
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|hiya|good (morning|afternoon|evening)|thanks|thank you|how are you)\b[\s!.?,]*\w{0,12}[\s!.?]*$"
+)
+
+# Clinic topics, matched at word starts ("book" matches "booking" but not "facebook")
+GENERAL_TERMS = [
+    "pain", "hurt", "injur", "knee", "back", "shoulder", "neck", "hip", "ankle", "elbow", "wrist",
+    "sprain", "strain", "stiff", "physio", "therap", "rehab", "surgery", "acl", "arthritis",
+    "frozen", "appointment", "book", "opening", "hours", "price", "cost", "treat", "clinic",
+    "exercise", "posture", "sport", "intake", "referral", "muscle", "recover",
+]
+GENERAL_PATTERN = re.compile(r"\b(" + "|".join(re.escape(t) for t in GENERAL_TERMS) + r")\w*")
+
+# Seed examples for the centroid tier; extend as real transcripts are labelled.
+INTENT_EXAMPLES = {
+    "handoff": [
+        "Can I speak to a real person?",
+        "I want to talk to a physiotherapist directly",
+        "Please have someone call me back",
+        "Is there a live chat with a human?",
+        "Connect me with a consultant",
+        "I'd rather talk to someone from the clinic",
+    ],
+    "general": [
+        "Hi there",
+        "What are your opening hours?",
+        "My knee hurts when I climb stairs",
+        "Do you treat frozen shoulder?",
+        "How do I book an appointment?",
+        "What is ACL rehab like after surgery?",
+        "How much does a session cost?",
+    ],
+    "other": [
+        "What's the weather tomorrow?",
+        "Write me a poem about cats",
+        "Who won the football match yesterday?",
+        "Can you help me with my tax return?",
+        "Tell me a joke",
+    ],
+}
+
+LLM_SYSTEM_MSG = (
+    "You are an assistant that classifies the intent of a user's message. "
+    "Return only one of the following: 'handoff', 'general', or 'other'."
+)
+
+
+def classify_with_rules(text):
+    lowered = text.lower().strip()
+    if any(p.search(lowered) for p in HANDOFF_PATTERNS):
+        return IntentResult("handoff", 0.95, "rules")
+    clinic_topic = GENERAL_PATTERN.search(lowered) is not None
+    if AMBIGUOUS_HANDOFF_PATTERN.search(lowered):
+        # A bare "call", "talk" or "human" is often not a handoff ("what do you
+        # call...", "the human shoulder"): guess, but below the threshold
+        return IntentResult("general" if clinic_topic else "handoff", 0.6, "rules")
+    if GREETING_PATTERN.match(lowered):
+        return IntentResult("general", 0.9, "rules")
+    if clinic_topic:
+        return IntentResult("general", 0.8, "rules")
+    return IntentResult("general", 0.0, "rules")
+
+
+def classify_with_llm(text, model="gpt-3.5-turbo-0125"):
+    """
+    The original LLM classifier, minus the chat system prompt and history.
+    """
+    prompt = f"""
+Message: "{text}"
+
+What is the user's intent?
+Return just one word: handoff, general, or other.
+"""
+    def attempt(timeout):
+        with get_scheduler("chat").slot(INTERACTIVE, tokens=100, timeout=timeout):
+            return get_client(timeout=timeout, max_retries=0).chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": LLM_SYSTEM_MSG},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0,
+                max_tokens=3
+            )
+
+    # While the "intent" circuit is open this raises at once and classify()
+    # keeps the best local result
+    response = get_policy("intent").call(attempt)
+    record_usage(response.usage)
+    answer = response.choices[0].message.content.strip().lower().strip(".'\"")
+    return IntentResult(answer if answer in INTENTS else "general", 1.0, "llm")
+
+
+class IntentClassifier:
+    def __init__(self, threshold=0.75, embed_fn=None, llm_fn=classify_with_llm, examples=INTENT_EXAMPLES):
+        self.threshold = threshold
+        self.embed_fn = embed_fn
+        self.llm_fn = llm_fn
+        self.examples = examples
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def _get_centroids(self):
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    labels, vectors = [], []
+                    for label, texts in self.examples.items():
+                        rows = np.array([self.embed_fn(t) for t in texts], dtype="float32")
+                        rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+                        centroid = rows.mean(axis=0)
+                        labels.append(label)
+                        vectors.append(centroid / np.linalg.norm(centroid))
+                    self._centroids = (labels, np.vstack(vectors))
+        return self._centroids
+
+    def classify_with_centroids(self, text):
+        labels, centroids = self._get_centroids()
+        query = np.asarray(self.embed_fn(text), dtype="float32")
+        scores = centroids @ (query / np.linalg.norm(query))
+        order = np.argsort(scores)[::-1]
+        # Confidence from the margin between the best and runner-up centroid
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else 1.0
+        confidence = min(1.0, 0.5 + margin * 5)
+        return IntentResult(labels[order[0]], confidence, "centroid")
+
+    def classify(self, text):
+        best = classify_with_rules(text)
+        if best.confidence >= self.threshold:
+            return best
+
+        if self.embed_fn is not None:
+            try:
+                result = self.classify_with_centroids(text)
+                if result.confidence >= self.threshold:
+                    return result
+                if result.confidence > best.confidence:
+                    best = result
+            except Exception as e:
+                print(f"[Intent] Centroid tier failed: {e}")
+
+        if self.llm_fn is not None:
+            try:
+                return self.llm_fn(text)
+            except Exception as e:
+                print(f"[Intent] LLM tier failed: {e}")
+
+        return best
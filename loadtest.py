@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+
+from eval_intent import LABELLED_MESSAGES
+
+# ============================================================
+# Load Test + Benchmark
+# ============================================================
+# Drives requests at a fixed arrival rate (open loop: latency is measured from
+# each request's scheduled start, so a backed-up system cannot hide its queue)
+# and reports p50/p95/p99 per stage.
+# Usage:
+#   python loadtest.py pipeline --mock --qps 20 --duration 30
+#       in-process detect_intent -> build_prompt_with_context ->
+#       get_completion_from_messages against a local mock_openai.py server
+#   python loadtest.py endpoint --url http://127.0.0.1:8000/endpoint --qps 50
+#       HTTP load on a running api.py / asgi_api.py (start the service with
+#       OPENAI_BASE_URL pointing at `python mock_openai.py` to stay offline)
+# Add --save-baseline FILE to record a run, and --baseline FILE to compare
+# with it; the exit code is 1 when a percentile regressed beyond --tolerance.
+PERCENTILES = (50, 95, 99)
+NOISE_FLOOR_MS = 5.0  # ignore regressions smaller than this
+
+
+class StageTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = 0
+        self.requests = 0
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds * 1000)
+
+    def finish(self, error):
+        with self._lock:
+            self.requests += 1
+            self.errors += bool(error)
+
+    def summary(self, elapsed):
+        with self._lock:
+            stages = {
+                stage: dict({f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES},
+                            count=len(values), mean=round(float(np.mean(values)), 2))
+                for stage, values in self.samples.items()
+            }
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+                "throughput_qps": round(self.requests / elapsed, 2) if elapsed else 0.0,
+                "stages": stages,
+            }
+
+
+def run_open_loop(run_one, qps, duration, concurrency):
+    """
+    Call run_one(i, scheduled_at) at qps for duration seconds on a thread
+    pool. Returns the wall time from the first arrival to the last completion.
+    """
+    total = int(qps * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadtest") as pool:
+        for i in range(total):
+            scheduled_at = start + i / qps
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run_one, i, scheduled_at)
+    return time.perf_counter() - start
+
+
+def query_for(i, unique):
+    text = LABELLED_MESSAGES[i % len(LABELLED_MESSAGES)][0]
+    # A unique suffix defeats the embedding and response caches
+    return f"{text} (#{i})" if unique else text
+
+
+def pipeline_runner(timings, unique):
+    import chat_core
+
+    chat_core.warm_up()
+
+    def run_one(i, scheduled_at):
+        error = False
+        try:
+            query = query_for(i, unique)
+            started = time.perf_counter()
+            timings.record("queue", started - scheduled_at)
+
+            intent = chat_core.detect_intent(query)
+            after_intent = time.perf_counter()
+            timings.record("intent", after_intent - started)
+
+            if intent != "handoff":
+                prompt = chat_core.build_prompt_with_context(query)
+                after_prompt = time.perf_counter()
+                timings.record("retrieval", after_prompt - after_intent)
+
+                reply = chat_core.get_completion_from_messages([{"role": "user", "content": prompt}])
+                timings.record("completion", time.perf_counter() - after_prompt)
+                error = reply in chat_core.FALLBACK_REPLIES
+        except Exception as e:
+            print(f"[Load Test] Request {i} failed: {e}")
+            error = True
+        timings.record("total", time.perf_counter() - scheduled_at)
+        timings.finish(error)
+
+    return run_one
+
+
+def endpoint_runner(timings, url, unique, timeout):
+    import httpx
+
+    client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=1000))
+    status_counts = {}
+    lock = threading.Lock()
+
+    def run_one(i, scheduled_at):
+        status = "error"
+        try:
+            response = client.post(url, json={"message": query_for(i, unique)})
+            status = response.status_code
+        except Exception as e:
+            print(f"[Load Test] Request {i} failed: {e}")
+        timings.record("total", time.perf_counter() - scheduled_at)
+        timings.finish(status != 200)
+        with lock:
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    run_one.status_counts = status_counts
+    return run_one
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """
+    Return a list of human-readable regressions (empty when none).
+    """
+    regressions = []
+    for stage, stats in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None:
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}"
+            current, previous = stats[key], base.get(key)
+            if previous and current > previous * (1 + tolerance) and current - previous > NOISE_FLOOR_MS:
+                regressions.append(f"{stage} {key}: {previous:.1f} -> {current:.1f} ms (+{current / previous - 1:.0%})")
+    if result["error_rate"] > baseline.get("error_rate", 0.0) + 0.01:
+        regressions.append(f"error rate: {baseline.get('error_rate', 0.0):.2%} -> {result['error_rate']:.2%}")
+    return regressions
+
+
+def print_report(result):
+    print(f"requests {result['requests']}  errors {result['errors']} ({result['error_rate']:.2%})  "
+          f"throughput {result['throughput_qps']} req/s")
+    print(f"  {'stage':<12}{'count':>7}{'mean':>10}" + "".join(f"{f'p{p}':>10}" for p in PERCENTILES) + "  (ms)")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<12}{stats['count']:>7}{stats['mean']:>10.1f}"
+              + "".join(f"{stats[f'p{p}']:>10.1f}" for p in PERCENTILES))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the chat pipeline or the /endpoint API.")
+    parser.add_argument("target", choices=["pipeline", "endpoint"])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/endpoint")
+    parser.add_argument("--qps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of arrivals")
+    parser.add_argument("--concurrency", type=int, default=256, help="client threads")
+    parser.add_argument("--timeout", type=float, default=60.0, help="HTTP timeout (endpoint)")
+    parser.add_argument("--unique", action="store_true", help="make every query unique to bypass caches")
+    parser.add_argument("--mock", action="store_true", help="run the pipeline against a local mock_openai.py")
+    parser.add_argument("--chat-latency", default="lognormal:800:2000")
+    parser.add_argument("--embedding-latency", default="lognormal:120:300")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0)
+    parser.add_argument("--error-prob", type=float, default=0.0, help="mock: fraction of calls answered with 500")
+    parser.add_argument("--requests-per-min", type=int, help="mock: enforce this limit per endpoint")
+    parser.add_argument("--baseline", help="compare against this baseline JSON")
+    parser.add_argument("--save-baseline", help="write this run's results to a baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    _ = load_dotenv(find_dotenv())
+
+    if args.mock:
+        from mock_openai import start_mock_server
+        server, base_url = start_mock_server(chat_latency=args.chat_latency,
+                                             embedding_latency=args.embedding_latency,
+                                             rate_limit_prob=args.rate_limit_prob,
+                                             error_prob=args.error_prob,
+                                             requests_per_min=args.requests_per_min)
+        # Must be set before chat_core creates the client and the index store
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["EMBEDDING_STORE_DIR"] = tempfile.mkdtemp(prefix="loadtest-store-")
+        print(f"Mock OpenAI at {base_url}")
+
+    timings = StageTimings()
+    if args.target == "pipeline":
+        run_one = pipeline_runner(timings, args.unique)
+    else:
+        run_one = endpoint_runner(timings, args.url, args.unique, args.timeout)
+
+    elapsed = run_open_loop(run_one, args.qps, args.duration, args.concurrency)
+    result = dict(timings.summary(elapsed), target=args.target, qps=args.qps)
+    print_report(result)
+    if args.target == "endpoint":
+        print(f"  status codes {run_one.status_counts}")
+    if args.mock:
+        print(f"  mock calls   {server.state.counts}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(result, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import time
+import threading
+import contextlib
+from collections import deque
+import numpy as np
+
+# ============================================================
+# Per-stage Latency Metrics (Prometheus text format)
+# ============================================================
+# Pipeline hops time themselves with `with timed("stage"):` or observe().
+# Each stage keeps a cumulative histogram for Prometheus scrapes plus a window
+# of recent samples for the percentiles shown in the Streamlit debug panel.
+# render_prometheus() also exports token usage, connection reuse and cache hit
+# rates, which live with their own modules. Stages used by the app:
+#   intent, lexical_search, query_embedding, faiss_search, prompt_assembly,
+#   completion, completion_first_token, sheets_write, and openai_intent,
+#   openai_embedding, openai_completion (each attempt of a call made through
+#   resilience.py, scheduler wait included; their p95 sets the hedge delay)
+# Prompt sizes are exported the same way, as token histograms per prompt part
+# (system, summary, history, user, total; see context_manager.py).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 1500, 2000, 2500, 3000, 4000, 8000)
+RECENT_SAMPLES = 1000
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            self.recent.append(seconds)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.bucket_counts), self.count, self.sum, list(self.recent)
+
+
+_lock = threading.Lock()
+_histograms = {}
+_token_histograms = {}
+
+
+def observe(stage, seconds):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+
+def observe_tokens(part, tokens):
+    histogram = _token_histograms.get(part)
+    if histogram is None:
+        with _lock:
+            histogram = _token_histograms.setdefault(part, Histogram(TOKEN_BUCKETS))
+    histogram.observe(tokens)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def stage_summary():
+    """
+    {stage: {count, mean_ms, p50_ms, p95_ms, p99_ms}} over recent samples.
+    """
+    summary = {}
+    for stage, histogram in sorted(_histograms.items()):
+        _, count, _, recent = histogram.snapshot()
+        if not recent:
+            continue
+        p50, p95, p99 = (float(v) * 1000 for v in np.percentile(recent, [50, 95, 99]))
+        summary[stage] = {
+            "count": count,
+            "mean_ms": round(float(np.mean(recent)) * 1000, 2),
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+        }
+    return summary
+
+
+def recent_percentile(stage, q, min_samples=1):
+    """
+    The q-th percentile of the stage's recent samples in seconds, or None
+    with fewer than min_samples.
+    """
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        return None
+    _, _, _, recent = histogram.snapshot()
+    if len(recent) < max(1, min_samples):
+        return None
+    return float(np.percentile(recent, q))
+
+
+def _gauge_lines(name, help_text, values, label):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for key, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f'{name}{{{label}="{key}"}} {value}')
+    return lines
+
+
+def _histogram_lines(name, help_text, histograms, label):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key, histogram in sorted(histograms.items()):
+        bucket_counts, count, total, _ = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {total}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {count}')
+    return lines
+
+
+def render_prometheus(extra_stats=None):
+    """
+    Prometheus text exposition of the stage and prompt-token histograms, plus
+    one gauge family per entry of extra_stats ({name: (help, {key: value})}).
+    """
+    lines = _histogram_lines("chatbot_stage_seconds", "Latency of each message pipeline stage.",
+                             _histograms, "stage")
+    lines.extend(_histogram_lines("chatbot_prompt_tokens", "Tokens in each part of the prompts sent.",
+                                  _token_histograms, "part"))
+
+    for name, (help_text, values) in (extra_stats or {}).items():
+        lines.extend(_gauge_lines(name, help_text, values, "stat"))
+    return "\n".join(lines) + "\n"
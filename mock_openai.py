@@ -0,0 +1,273 @@
+import sys
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from rate_limiter import TokenBucket
+
+# ============================================================
+# Local OpenAI Stand-in (chat completions + embeddings)
+# ============================================================
+# For load tests and benchmarks without the paid API. Point the app at it with
+#   OPENAI_BASE_URL=http://127.0.0.1:8899/v1 OPENAI_API_KEY=mock
+# Usage:
+#   python mock_openai.py --chat-latency lognormal:800:2000 --rate-limit-prob 0.05
+#
+# Latency specs (milliseconds): fixed:MS, uniform:LO:HI, lognormal:MEDIAN:P95.
+# 429s come from --rate-limit-prob (random) and/or --requests-per-min, which
+# enforces a real per-endpoint limit (one second of burst) like the API does.
+# Embeddings are deterministic: the same text always maps to the same unit
+# vector, so retrieval and the caches behave the same on every run.
+DEFAULT_PORT = 8899
+EMBEDDING_DIMS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
+MOCK_REPLY = ("Thanks for your question. Based on our clinic's guidance, gentle mobility work and a "
+              "physiotherapy assessment are a good place to start. Book a session for a tailored plan.")
+Z_95 = 1.6449  # standard normal 95th percentile
+
+
+def parse_latency(spec):
+    """
+    Return a function sampling one latency in seconds from a spec string.
+    """
+    kind, *params = spec.split(":")
+    values = [float(p) / 1000 for p in params]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        median, p95 = values
+        sigma = math.log(p95 / median) / Z_95 if p95 > median else 0.0
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Bad latency spec {spec!r}; use fixed:MS, uniform:LO:HI or lognormal:MEDIAN:P95")
+
+
+def mock_embedding(text, dims):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dims).astype("float32")
+    return vector / np.linalg.norm(vector)
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockState:
+    def __init__(self, chat_latency, embedding_latency, rate_limit_prob=0.0, error_prob=0.0,
+                 requests_per_min=10000, tokens_per_min=2000000, enforce_limits=False):
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.rate_limit_prob = rate_limit_prob
+        self.error_prob = error_prob
+        self.requests_per_min = requests_per_min
+        self.tokens_per_min = tokens_per_min
+        self.lock = threading.Lock()
+        self.counts = {"chat": 0, "embeddings": 0, "rate_limited": 0, "errors": 0}
+        self.buckets = None
+        if enforce_limits:
+            burst = max(1.0, requests_per_min / 60.0)
+            self.buckets = {kind: TokenBucket(requests_per_min, capacity=burst) for kind in ("chat", "embeddings")}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _rate_limit_headers(self):
+        return {
+            "x-ratelimit-limit-requests": str(self.state.requests_per_min),
+            "x-ratelimit-remaining-requests": str(self.state.requests_per_min - 1),
+            "x-ratelimit-limit-tokens": str(self.state.tokens_per_min),
+            "x-ratelimit-remaining-tokens": str(self.state.tokens_per_min - 1000),
+            "x-ratelimit-reset-requests": "6ms",
+            "x-ratelimit-reset-tokens": "30ms",
+        }
+
+    def _over_limit(self, kind):
+        """
+        Answer 429 when the enforced requests/min budget is spent.
+        """
+        if self.state.buckets is None:
+            return False
+        bucket = self.state.buckets[kind]
+        with self.state.lock:
+            wait = bucket.wait_time(1)
+            if wait <= 0:
+                bucket.take(1)
+                return False
+            self.state.counts["rate_limited"] += 1
+        self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                        "code": "rate_limit_exceeded"}},
+                        dict(self._rate_limit_headers(), **{
+                            "retry-after": str(max(1, math.ceil(wait))),
+                            "x-ratelimit-remaining-requests": "0",
+                            "x-ratelimit-reset-requests": f"{int(wait * 1000) + 1}ms",
+                        }))
+        return True
+
+    def _inject_failure(self):
+        roll = random.random()
+        if roll < self.state.rate_limit_prob:
+            self.state.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            dict(self._rate_limit_headers(), **{"retry-after": "1",
+                                                                "x-ratelimit-remaining-requests": "0"}))
+            return True
+        if roll < self.state.rate_limit_prob + self.state.error_prob:
+            self.state.count("errors")
+            self._send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+            return True
+        return False
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/chat/completions"):
+            self.handle_chat(body)
+        elif self.path.endswith("/embeddings"):
+            self.handle_embeddings(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def handle_chat(self, body):
+        self.state.count("chat")
+        if self._over_limit("chat"):
+            return
+        time.sleep(self.state.chat_latency())
+        if self._inject_failure():
+            return
+
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") + 4 for m in body.get("messages", []))
+        # Pretend the provider cached every full 128-token block past the first 1024
+        cached_tokens = (prompt_tokens // 128) * 128 if prompt_tokens >= 1024 else 0
+        reply = MOCK_REPLY if body.get("max_tokens", 100) > 5 else "general"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(reply),
+            "total_tokens": prompt_tokens + estimate_tokens(reply),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-mock")
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": reply}}],
+                "usage": usage,
+            }, self._rate_limit_headers())
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        for name, value in self._rate_limit_headers().items():
+            self.send_header(name, value)
+        self.end_headers()
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def handle_embeddings(self, body):
+        self.state.count("embeddings")
+        if self._over_limit("embeddings"):
+            return
+        time.sleep(self.state.embedding_latency())
+        if self._inject_failure():
+            return
+
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        model = body.get("model", "text-embedding-3-small")
+        dims = body.get("dimensions") or EMBEDDING_DIMS.get(model, 1536)
+        data = []
+        for i, text in enumerate(inputs):
+            vector = mock_embedding(text, dims)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(estimate_tokens(t) for t in inputs)
+        self._send_json(200, {"object": "list", "data": data, "model": model,
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}},
+                        self._rate_limit_headers())
+
+
+def start_mock_server(port=0, chat_latency="lognormal:800:2000", embedding_latency="lognormal:120:300",
+                      rate_limit_prob=0.0, error_prob=0.0, requests_per_min=None):
+    """
+    Start the mock in a daemon thread. Returns (server, base_url); read
+    server.state.counts for request counts and call server.shutdown() to stop.
+    requests_per_min enforces that limit per endpoint.
+    """
+    state = MockState(parse_latency(chat_latency), parse_latency(embedding_latency), rate_limit_prob, error_prob,
+                      requests_per_min=requests_per_min or 10000, enforce_limits=requests_per_min is not None)
+    handler = type("BoundMockOpenAIHandler", (MockOpenAIHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI stand-in for load tests.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--chat-latency", default="lognormal:800:2000")
+    parser.add_argument("--embedding-latency", default="lognormal:120:300")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--error-prob", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--requests-per-min", type=int, help="enforce this limit per endpoint")
+    args = parser.parse_args(argv)
+
+    server, base_url = start_mock_server(args.port, args.chat_latency, args.embedding_latency,
+                                         args.rate_limit_prob, args.error_prob, args.requests_per_min)
+    print(f"Mock OpenAI listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
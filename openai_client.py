@@ -0,0 +1,208 @@
+import os
+import threading
+import httpx
+import openai
+
+from rate_limiter import scheduler_for_path
+
+# ============================================================
+# Shared OpenAI Client (pooled, keep-alive, instrumented)
+# ============================================================
+# All OpenAI calls go through one client so TLS/connection setup is paid once
+# per pooled connection instead of once per call. Tune with env vars:
+#   OPENAI_POOL_MAX_CONNECTIONS  - max open connections (default 20)
+#   OPENAI_POOL_MAX_KEEPALIVE    - idle connections kept alive (default 10)
+#   OPENAI_KEEPALIVE_EXPIRY      - seconds an idle connection is kept (default 60)
+#   OPENAI_TIMEOUT               - default request timeout in seconds (default 15)
+#   OPENAI_MAX_RETRIES           - retries with exponential backoff (default 2);
+#                                  intent, query embedding and completion calls
+#                                  retry in resilience.py instead
+#   OPENAI_ASYNC_POOL_MAX_CONNECTIONS - max connections of the async client used
+#                                  by the ASGI service (default 200); each
+#                                  in-flight request holds one connection
+POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+DEFAULT_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "15"))
+DEFAULT_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+ASYNC_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_ASYNC_POOL_MAX_CONNECTIONS", "200"))
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+class _ConnectionStats:
+    """
+    Counts HTTP requests and new TCP connections so the reuse rate can be read.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def trace(self, event_name, info):
+        # httpcore trace hook: fires once per new connection attempt
+        if event_name == "connection.connect_tcp.started":
+            with self._lock:
+                self.new_connections += 1
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    def snapshot(self):
+        with self._lock:
+            requests, new_connections = self.requests, self.new_connections
+        reused = max(requests - new_connections, 0)
+        return {
+            "requests": requests,
+            "new_connections": new_connections,
+            "reused_connections": reused,
+            "reuse_rate": (reused / requests) if requests else 0.0,
+        }
+
+
+connection_stats = _ConnectionStats()
+
+
+class _UsageStats:
+    """
+    Token usage reported by the API, including prompt tokens served from the
+    provider's prompt cache (usage.prompt_tokens_details.cached_tokens).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, usage):
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.cached_prompt_tokens += cached
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "prompt_cache_hit_rate": (self.cached_prompt_tokens / self.prompt_tokens) if self.prompt_tokens else 0.0,
+            }
+
+
+usage_stats = _UsageStats()
+
+
+def _observe_rate_limits(response):
+    # Feed status and x-ratelimit-* headers to the request scheduler
+    scheduler = scheduler_for_path(response.request.url.path)
+    if scheduler is not None:
+        scheduler.observe_response(response.status_code, response.headers)
+
+
+async def _observe_rate_limits_async(response):
+    _observe_rate_limits(response)
+
+
+def _build_http_client():
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=DEFAULT_TIMEOUT,
+        event_hooks={"request": [connection_stats.on_request], "response": [_observe_rate_limits]},
+    )
+
+
+def get_client(timeout=None, max_retries=None):
+    """
+    Return the process-wide OpenAI client. Per-call timeout/max_retries give a
+    lightweight view that still shares the same connection pool.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = openai.OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    http_client=_build_http_client(),
+                    timeout=DEFAULT_TIMEOUT,
+                    max_retries=DEFAULT_MAX_RETRIES,
+                )
+
+    options = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+    if max_retries is not None:
+        options["max_retries"] = max_retries
+    return _client.with_options(**options) if options else _client
+
+
+def get_async_client(timeout=None, max_retries=None):
+    """
+    Return the process-wide AsyncOpenAI client. It belongs to the event loop that first uses it, so call it
+    only from the ASGI server's loop.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=ASYNC_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=DEFAULT_TIMEOUT,
+                event_hooks={"response": [_observe_rate_limits_async]},
+            ),
+            timeout=DEFAULT_TIMEOUT,
+            max_retries=DEFAULT_MAX_RETRIES,
+        )
+
+    options = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+    if max_retries is not None:
+        options["max_retries"] = max_retries
+    return _async_client.with_options(**options) if options else _async_client
+
+
+def get_client_stats():
+    return connection_stats.snapshot()
+
+
+def record_usage(usage):
+    usage_stats.record(usage)
+
+
+def get_usage_stats():
+    return usage_stats.snapshot()
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.close()
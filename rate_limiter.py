@@ -0,0 +1,383 @@
+import os
+import re
+import time
+import asyncio
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict, deque
+
+# ============================================================
+# Token-bucket Rate Limiter
+# ============================================================
+class TokenBucket:
+    """
+    Allows `rate` units per `per` seconds with bursts up to `capacity`.
+    acquire(n) blocks until n units are available.
+    """
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = float(rate) / per
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, n=1):
+        n = min(float(n), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+    def wait_time(self, n=1):
+        """
+        Seconds until n units are available (0 if they are now); takes nothing.
+        """
+        n = min(float(n), self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (n - self._tokens) / self.rate)
+
+    def take(self, n=1):
+        with self._lock:
+            self._refill()
+            self._tokens -= min(float(n), self.capacity)
+
+    def set_rate(self, rate, per=60.0):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate) / per
+            self.capacity = float(rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+
+# ============================================================
+# Adaptive Request Scheduler for OpenAI calls
+# ============================================================
+# One scheduler per limit group ("chat", "embeddings"), shared by every thread
+# and event loop in the process. A call waits for a slot; slots are granted:
+#   - by priority: INTERACTIVE (user-facing replies, query embeddings, intent)
+#     before BACKGROUND (corpus re-indexing, history summaries)
+#   - round-robin across sessions within a priority, so one busy sender cannot
+#     starve the others
+#   - only while requests/min and tokens/min budgets allow; the budgets follow
+#     the x-ratelimit-* headers of every response (see openai_client.py)
+# Concurrency adapts AIMD-style: +1 slot per window of successes, halved on a
+# 429, and the queue pauses for the Retry-After the API asks for.
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+SCHEDULER_DEFAULTS = {
+    "chat": {
+        "requests_per_min": int(os.getenv("OPENAI_CHAT_REQUESTS_PER_MIN", "3500")),
+        "tokens_per_min": int(os.getenv("OPENAI_CHAT_TOKENS_PER_MIN", "160000")),
+        "initial_concurrency": int(os.getenv("OPENAI_CHAT_CONCURRENCY", "16")),
+        "max_concurrency": int(os.getenv("OPENAI_CHAT_MAX_CONCURRENCY", "128")),
+    },
+    "embeddings": {
+        "requests_per_min": int(os.getenv("EMBED_REQUESTS_PER_MIN", "3000")),
+        "tokens_per_min": int(os.getenv("EMBED_TOKENS_PER_MIN", "1000000")),
+        "initial_concurrency": int(os.getenv("EMBED_CONCURRENCY", "4")),
+        "max_concurrency": int(os.getenv("EMBED_MAX_CONCURRENCY", "32")),
+    },
+}
+QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30"))  # interactive calls only
+MAX_POLL_SECONDS = 0.5
+
+
+class SchedulerTimeout(Exception):
+    pass
+
+
+# Called when this thread/task is granted a slot (see on_slot_granted)
+_grant_hook = contextvars.ContextVar("scheduler_grant_hook", default=None)
+
+
+@contextlib.contextmanager
+def on_slot_granted(callback):
+    """
+    Call callback() whenever a slot is granted inside this block (same thread
+    or task). resilience.py uses it to tell time spent queueing here from time
+    spent waiting on OpenAI.
+    """
+    token = _grant_hook.set(callback)
+    try:
+        yield
+    finally:
+        _grant_hook.reset(token)
+
+
+def _notify_granted():
+    hook = _grant_hook.get()
+    if hook is not None:
+        hook()
+
+
+class _Ticket:
+    __slots__ = ("priority", "session", "tokens", "granted", "notify")
+
+    def __init__(self, priority, session, tokens, notify):
+        self.priority = priority
+        self.session = session
+        self.tokens = tokens
+        self.granted = False
+        self.notify = notify
+
+
+def parse_reset(value):
+    """
+    Seconds in an x-ratelimit-reset-* header such as "6ms", "20s" or "1m30.5s".
+    """
+    if not value:
+        return None
+    total, matched = 0.0, False
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    if matched:
+        return total
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class AdaptiveScheduler:
+    def __init__(self, name, requests_per_min, tokens_per_min, initial_concurrency=8,
+                 min_concurrency=1, max_concurrency=64):
+        self.name = name
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self._request_bucket = TokenBucket(requests_per_min)
+        self._token_bucket = TokenBucket(tokens_per_min)
+        self._lock = threading.Lock()
+        self._queues = {p: OrderedDict() for p in PRIORITIES}  # session -> deque of tickets
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self.stats_counts = {"granted": 0, "timeouts": 0, "rate_limited": 0, "successes": 0}
+
+    # ---------- queueing (call with self._lock held) ----------
+    def _enqueue(self, ticket):
+        self._queues[ticket.priority].setdefault(ticket.session, deque()).append(ticket)
+
+    def _remove(self, ticket):
+        tickets = self._queues[ticket.priority].get(ticket.session)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queues[ticket.priority][ticket.session]
+
+    def _peek(self):
+        for priority in PRIORITIES:
+            sessions = self._queues[priority]
+            if sessions:
+                return sessions[next(iter(sessions))][0]
+        return None
+
+    def _pop(self, ticket):
+        sessions = self._queues[ticket.priority]
+        tickets = sessions.pop(ticket.session)
+        tickets.popleft()
+        if tickets:
+            sessions[ticket.session] = tickets  # back of the line: round-robin
+
+    def _dispatch(self):
+        """
+        Grant slots to queued tickets while concurrency and rate budgets allow.
+        Returns the seconds until it is worth trying again, or None.
+        """
+        while self.in_flight < int(self.concurrency):
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            ticket = self._peek()
+            if ticket is None:
+                return None
+            wait = max(self._request_bucket.wait_time(1), self._token_bucket.wait_time(ticket.tokens))
+            if wait > 0:
+                return wait
+            self._request_bucket.take(1)
+            self._token_bucket.take(ticket.tokens)
+            self._pop(ticket)
+            ticket.granted = True
+            self.in_flight += 1
+            self.stats_counts["granted"] += 1
+            ticket.notify()
+        return None
+
+    def _default_timeout(self, priority, timeout):
+        if timeout is not None:
+            return timeout
+        return QUEUE_TIMEOUT if priority == INTERACTIVE else None
+
+    # ---------- slots ----------
+    def acquire(self, priority=INTERACTIVE, session=None, tokens=0, timeout=None):
+        """
+        Block until a slot is granted; returns the ticket to pass to release().
+        Raises SchedulerTimeout if it waited longer than timeout (interactive
+        calls default to OPENAI_QUEUE_TIMEOUT, background calls wait forever).
+        """
+        timeout = self._default_timeout(priority, timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        event = threading.Event()
+        ticket = _Ticket(priority, session, tokens, event.set)
+        with self._lock:
+            self._enqueue(ticket)
+        while True:
+            with self._lock:
+                wake = None if ticket.granted else self._dispatch()
+                if ticket.granted:
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._remove(ticket)
+                    self.stats_counts["timeouts"] += 1
+                    raise SchedulerTimeout(f"No {self.name} slot within {timeout}s")
+            event.wait(min(wake or MAX_POLL_SECONDS, MAX_POLL_SECONDS))
+            event.clear()
+        _notify_granted()
+        return ticket
+
+    async def acquire_async(self, priority=INTERACTIVE, session=None, tokens=0, timeout=None):
+        """
+        acquire() for coroutines: waits on the event loop, not a thread.
+        """
+        timeout = self._default_timeout(priority, timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        ticket = _Ticket(priority, session, tokens, notify)
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._lock:
+                    wake = None if ticket.granted else self._dispatch()
+                    if ticket.granted:
+                        break
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self._remove(ticket)
+                        self.stats_counts["timeouts"] += 1
+                        raise SchedulerTimeout(f"No {self.name} slot within {timeout}s")
+                try:
+                    await asyncio.wait_for(asyncio.shield(granted), min(wake or MAX_POLL_SECONDS, MAX_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+            _notify_granted()
+            return ticket
+        except asyncio.CancelledError:
+            with self._lock:
+                self._remove(ticket)
+            if ticket.granted:
+                self.release(ticket)
+            raise
+
+    def release(self, ticket):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, priority=INTERACTIVE, session=None, tokens=0, timeout=None):
+        ticket = self.acquire(priority, session, tokens, timeout)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, priority=INTERACTIVE, session=None, tokens=0, timeout=None):
+        ticket = await self.acquire_async(priority, session, tokens, timeout)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    # ---------- feedback from responses ----------
+    def observe_response(self, status_code, headers):
+        """
+        Adapt to one HTTP response: AIMD on success/429, and budgets from the
+        x-ratelimit-* headers.
+        """
+        with self._lock:
+            if status_code == 429:
+                self._on_rate_limited(headers)
+            elif status_code < 400:
+                self.stats_counts["successes"] += 1
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self._apply_headers(headers)
+            self._dispatch()
+
+    def _on_rate_limited(self, headers):
+        now = time.monotonic()
+        self.stats_counts["rate_limited"] += 1
+        # One burst of 429s from the same window counts as one decrease
+        if now - self._last_decrease > 1.0:
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            self._last_decrease = now
+        # With x-ratelimit-* headers, _apply_headers pauses until the exhausted
+        # budget resets; otherwise fall back to Retry-After
+        if "x-ratelimit-remaining-requests" not in headers and "x-ratelimit-remaining-tokens" not in headers:
+            retry_after = parse_reset(headers.get("retry-after")) or 1.0
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+    def _apply_headers(self, headers):
+        now = time.monotonic()
+        for kind, bucket in (("requests", self._request_bucket), ("tokens", self._token_bucket)):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if limit and limit.isdigit() and abs(int(limit) / 60.0 - bucket.rate) > 1e-9:
+                bucket.set_rate(int(limit))
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is not None and remaining.isdigit() and int(remaining) == 0 and reset:
+                self._paused_until = max(self._paused_until, now + reset)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.stats_counts)
+            counts["in_flight"] = self.in_flight
+            counts["concurrency_limit"] = round(self.concurrency, 2)
+            for priority, name in ((INTERACTIVE, "queued_interactive"), (BACKGROUND, "queued_background")):
+                counts[name] = sum(len(t) for t in self._queues[priority].values())
+            counts["paused_seconds"] = round(max(0.0, self._paused_until - time.monotonic()), 3)
+        return counts
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name):
+    """
+    The process-wide scheduler for a limit group ("chat" or "embeddings").
+    """
+    scheduler = _schedulers.get(name)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(name)
+            if scheduler is None:
+                scheduler = _schedulers[name] = AdaptiveScheduler(name, **SCHEDULER_DEFAULTS[name])
+    return scheduler
+
+
+def scheduler_for_path(path):
+    if path.endswith("/embeddings"):
+        return get_scheduler("embeddings")
+    if path.endswith("/chat/completions"):
+        return get_scheduler("chat")
+    return None
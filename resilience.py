@@ -0,0 +1,416 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+
+from metrics import observe, recent_percentile
+from rate_limiter import SchedulerTimeout, on_slot_granted
+
+# ============================================================
+# Retries, Hedged Requests and Circuit Breakers for OpenAI calls
+# ============================================================
+# Each call type ("intent", "embedding", "completion") has a CallPolicy that
+# wraps one attempt function, fn(timeout), with:
+#   deadline - the caller waits at most this long across all attempts; each
+#              attempt gets min(attempt_timeout, time left)
+#   retries  - timeouts, connection errors, 429s and 5xx are retried after a
+#              full-jitter exponential backoff (or the Retry-After, if
+#              longer), up to max_attempts and only while the deadline still
+#              leaves room for another attempt
+#   hedging  - if an attempt is still running after the p95 latency of recent
+#              attempts, a duplicate is sent and the first answer wins (the
+#              loser is cancelled on the async path, ignored on the sync
+#              path). At most HEDGE_BUDGET of calls are hedged, so a slow
+#              upstream never sees double the load
+#   breaker  - after breaker_failures upstream failures in a row (timeouts,
+#              connection errors, 5xx; not 429s, which the scheduler handles,
+#              nor time spent queueing for a local scheduler slot)
+#              calls fail fast with CircuitOpen for breaker_cooldown seconds,
+#              then one probe call decides whether the circuit closes again.
+#              Callers degrade instead of waiting: local intent tiers,
+#              BM25-only retrieval, cached or canned replies
+# The OpenAI SDK's own retries are turned off for these calls (max_retries=0).
+# Override per call type, e.g. OPENAI_COMPLETION_DEADLINE=20,
+# OPENAI_INTENT_HEDGE=0, OPENAI_EMBEDDING_MAX_ATTEMPTS=2,
+# OPENAI_COMPLETION_BREAKER_COOLDOWN=60.
+POLICY_DEFAULTS = {
+    "intent": {"deadline": 4.0, "attempt_timeout": 2.5, "max_attempts": 2, "hedge": True, "hedge_delay": 1.0},
+    "embedding": {"deadline": 6.0, "attempt_timeout": 3.0, "max_attempts": 3, "hedge": True, "hedge_delay": 0.5},
+    "completion": {"deadline": 20.0, "attempt_timeout": 10.0, "max_attempts": 3, "hedge": True, "hedge_delay": 4.0},
+}
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30.0
+HEDGE_BUDGET = float(os.getenv("OPENAI_HEDGE_BUDGET", "0.1"))  # max fraction of calls hedged
+HEDGE_MIN_SAMPLES = 20  # use the configured hedge_delay until this many attempts were timed
+MIN_HEDGE_DELAY = 0.05
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4.0
+MIN_ATTEMPT_SECONDS = 0.5  # no retry unless at least this much of the deadline is left
+ATTEMPT_WORKERS = int(os.getenv("OPENAI_ATTEMPT_WORKERS", "256"))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def _env(kind, key, default):
+    value = os.getenv(f"OPENAI_{kind.upper()}_{key.upper()}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value != "0"
+    return type(default)(value)
+
+
+def _outcome(error):
+    """
+    "failure" for upstream trouble (retried, counts toward the breaker),
+    "retry" for rate limits (retried only), "fatal" for everything else.
+    """
+    if isinstance(error, (DeadlineExceeded, openai.APIConnectionError, openai.InternalServerError)):
+        return "failure"
+    if isinstance(error, openai.RateLimitError):
+        return "retry"
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return "failure"
+    return "fatal"
+
+
+class _Attempt:
+    """
+    When a racing attempt got its scheduler slot (None while still queued).
+    Attempt functions take a rate_limiter slot before calling OpenAI.
+    """
+    __slots__ = ("granted_at",)
+
+    def __init__(self):
+        self.granted_at = None
+
+    def granted(self):
+        self.granted_at = time.monotonic()
+
+
+def _still_queued(attempts):
+    """
+    True if no attempt got a slot: the time went to the local queue, and
+    OpenAI never saw the call.
+    """
+    return all(a.granted_at is None for a in attempts)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after")) if response is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.times_opened = 0
+
+    def allow(self):
+        """
+        True if a call may go upstream now. After the cooldown one caller at a
+        time gets through as the probe.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def is_open(self):
+        # True while calls are failing fast; False again once a probe may go
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+            self._probing = False
+
+    def record_neutral(self):
+        # A 429 or a local error says nothing about upstream health; free the probe
+        with self._lock:
+            self._probing = False
+
+
+class CallPolicy:
+    def __init__(self, kind, deadline, attempt_timeout, max_attempts, hedge, hedge_delay,
+                 breaker_failures=BREAKER_FAILURES, breaker_cooldown=BREAKER_COOLDOWN):
+        self.kind = kind
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = hedge
+        self.default_hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self._lock = threading.Lock()
+        self.stats_counts = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                             "failures": 0, "short_circuited": 0}
+
+    @property
+    def stage(self):
+        return f"openai_{self.kind}"
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats_counts[key] += n
+
+    def hedge_delay(self):
+        p95 = recent_percentile(self.stage, 95, min_samples=HEDGE_MIN_SAMPLES)
+        return max(MIN_HEDGE_DELAY, p95) if p95 is not None else self.default_hedge_delay
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.stats_counts["hedges"] >= HEDGE_BUDGET * self.stats_counts["calls"]:
+                return False
+            self.stats_counts["hedges"] += 1
+            return True
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpen(f"OpenAI {self.kind} circuit is open")
+
+    def _after_error(self, error, attempt, deadline_at):
+        """
+        Record a failed attempt; return the backoff before the next one, or
+        None when the call should give up.
+        """
+        outcome = _outcome(error)
+        if outcome == "failure":
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_neutral()
+        if outcome == "fatal" or attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        delay = max(delay, _retry_after(error) or 0.0)
+        if time.monotonic() + delay + MIN_ATTEMPT_SECONDS > deadline_at:
+            return None
+        return delay
+
+    # ---------- sync ----------
+    def _timed(self, fn, timeout, sample=True, attempt=None):
+        start = time.perf_counter()
+        if attempt is None:
+            result = fn(timeout)
+        else:
+            with on_slot_granted(attempt.granted):
+                result = fn(timeout)
+        if sample:
+            observe(self.stage, time.perf_counter() - start)
+        return result
+
+    def _race(self, fn, timeout):
+        """
+        One attempt, plus a hedge if it is slower than the hedge delay. Runs
+        on the attempt pool so the caller can stop waiting at the timeout.
+        Raises SchedulerTimeout rather than DeadlineExceeded when the time
+        went to waiting for a scheduler slot, so it does not count against
+        the breaker.
+        """
+        pool = _get_attempt_pool()
+        start = time.monotonic()
+        give_up = start + timeout
+        hedge_at = start + self.hedge_delay()
+        attempts = [_Attempt()]
+        primary = pool.submit(self._timed, fn, timeout, True, attempts[0])
+        pending, error = {primary}, None
+        while pending:
+            now = time.monotonic()
+            if now >= give_up:
+                break
+            until = give_up if hedge_at is None else min(give_up, hedge_at)
+            done, pending = wait(pending, timeout=until - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                if primary in pending and self._take_hedge():
+                    attempts.append(_Attempt())
+                    pending.add(pool.submit(self._timed, fn, max(0.0, give_up - time.monotonic()), True, attempts[-1]))
+        if error is not None and not pending:
+            raise error
+        if _still_queued(attempts):
+            raise SchedulerTimeout(f"No slot for the OpenAI {self.kind} call within {timeout:.1f}s")
+        raise DeadlineExceeded(f"OpenAI {self.kind} call took longer than {timeout:.1f}s")
+
+    def call(self, fn, hedge=None, sample=True):
+        """
+        Run fn(timeout) under this policy and return its result. Raises
+        CircuitOpen without calling fn while the circuit is open, and the last
+        error (or DeadlineExceeded) when every attempt failed. sample=False
+        keeps the attempts out of the hedge-delay p95 (e.g. opening a stream,
+        which returns long before a full completion would).
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self._count("calls")
+        self._admit()
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self._count("attempts")
+            timeout = min(self.attempt_timeout, deadline_at - time.monotonic())
+            try:
+                # Without hedging the attempt runs inline, bounded by its own timeout
+                result = self._race(fn, timeout) if hedge else self._timed(fn, timeout, sample)
+            except Exception as e:
+                delay = self._after_error(e, attempt, deadline_at)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+                self._admit()
+                continue
+            self.breaker.record_success()
+            return result
+
+    # ---------- async ----------
+    async def _atimed(self, fn, timeout, attempt):
+        start = time.perf_counter()
+        with on_slot_granted(attempt.granted):  # this task's own context
+            result = await fn(timeout)
+        observe(self.stage, time.perf_counter() - start)
+        return result
+
+    async def _arace(self, fn, timeout, hedge):
+        start = time.monotonic()
+        give_up = start + timeout
+        hedge_at = start + self.hedge_delay() if hedge else None
+        attempts = [_Attempt()]
+        primary = asyncio.ensure_future(self._atimed(fn, timeout, attempts[0]))
+        pending, error = {primary}, None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= give_up:
+                    break
+                until = give_up if hedge_at is None else min(give_up, hedge_at)
+                done, pending = await asyncio.wait(pending, timeout=until - now, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if primary in pending and self._take_hedge():
+                        attempts.append(_Attempt())
+                        pending.add(asyncio.ensure_future(
+                            self._atimed(fn, max(0.0, give_up - time.monotonic()), attempts[-1])))
+            if error is not None and not pending:
+                raise error
+            if _still_queued(attempts):
+                raise SchedulerTimeout(f"No slot for the OpenAI {self.kind} call within {timeout:.1f}s")
+            raise DeadlineExceeded(f"OpenAI {self.kind} call took longer than {timeout:.1f}s")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acall(self, fn, hedge=None):
+        """
+        call() for coroutines: fn(timeout) is awaited, and a losing hedge is
+        cancelled.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self._count("calls")
+        self._admit()
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self._count("attempts")
+            timeout = min(self.attempt_timeout, deadline_at - time.monotonic())
+            try:
+                result = await self._arace(fn, timeout, hedge)
+            except Exception as e:
+                delay = self._after_error(e, attempt, deadline_at)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(delay)
+                self._admit()
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.stats_counts)
+        counts["breaker_open"] = int(self.breaker.is_open())
+        counts["breaker_times_opened"] = self.breaker.times_opened
+        counts["consecutive_failures"] = self.breaker.failures
+        counts["hedge_delay_seconds"] = round(self.hedge_delay(), 3)
+        return counts
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+_attempt_pool = None
+
+
+def _get_attempt_pool():
+    global _attempt_pool
+    if _attempt_pool is None:
+        with _policies_lock:
+            if _attempt_pool is None:
+                _attempt_pool = ThreadPoolExecutor(max_workers=ATTEMPT_WORKERS, thread_name_prefix="openai-attempt")
+    return _attempt_pool
+
+
+def get_policy(kind):
+    """
+    Return the process-wide policy for "intent", "embedding" or "completion".
+    """
+    policy = _policies.get(kind)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(kind)
+            if policy is None:
+                options = {key: _env(kind, key, default) for key, default in POLICY_DEFAULTS[kind].items()}
+                options["breaker_failures"] = _env(kind, "breaker_failures", BREAKER_FAILURES)
+                options["breaker_cooldown"] = _env(kind, "breaker_cooldown", BREAKER_COOLDOWN)
+                policy = _policies[kind] = CallPolicy(kind, **options)
+    return policy
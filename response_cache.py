@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# ============================================================
+# Response Cache for Repeated / Near-duplicate Questions
+# ============================================================
+# Completions run at temperature=0, so the same question over the same
+# retrieved articles and conversation gets the same answer. Two tiers:
+#   exact    - key = normalized query + model + retrieved article ids + context
+#   semantic - same model, article ids and context, query embedding cosine >= threshold
+# The context is a hash of the conversation sent with the question (summary
+# and fitted history; "" for a first message), so a reply that depends on one
+# sender's history is never served to another.
+# While completions are unavailable, get_similar() drops the article-id match
+# so a near-duplicate question can still get a cached answer.
+# Entries live in an in-memory LRU with a TTL; set RESPONSE_CACHE_DB to also
+# persist them in SQLite so they survive restarts and are shared by workers.
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+SEMANTIC_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+DB_PATH = os.getenv("RESPONSE_CACHE_DB", "")
+
+
+def normalize_query(text):
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(query, model, article_ids, context=""):
+    raw = json.dumps([normalize_query(query), model, list(article_ids), context])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS,
+                 semantic_threshold=SEMANTIC_THRESHOLD, db_path=DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> entry dict
+        self.stats_counts = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "degraded_hits": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, article_ids TEXT, "
+                "embedding BLOB, response TEXT, created REAL, context TEXT DEFAULT '')"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+            if "context" not in columns:  # database from before context keys
+                self._db.execute("ALTER TABLE responses ADD COLUMN context TEXT DEFAULT ''")
+            self._db.commit()
+            self._load_recent()
+
+    def _load_recent(self):
+        cutoff = time.time() - self.ttl
+        rows = self._db.execute(
+            "SELECT key, model, article_ids, embedding, response, created, context FROM responses "
+            "WHERE created >= ? ORDER BY created DESC LIMIT ?", (cutoff, self.max_entries)
+        ).fetchall()
+        for key, model, article_ids, embedding, response, created, context in reversed(rows):
+            self._entries[key] = self._entry(model, json.loads(article_ids), embedding, response, created, context)
+
+    @staticmethod
+    def _entry(model, article_ids, embedding, response, created, context=""):
+        if isinstance(embedding, (bytes, bytearray)):
+            embedding = np.frombuffer(embedding, dtype="float32")
+        return {"model": model, "article_ids": list(article_ids), "embedding": embedding,
+                "response": response, "created": created, "context": context or ""}
+
+    def _expired(self, entry):
+        return time.time() - entry["created"] > self.ttl
+
+    def _get_exact(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._expired(entry):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT model, article_ids, embedding, response, created, context FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and time.time() - row[4] <= self.ttl:
+                entry = self._entry(row[0], json.loads(row[1]), row[2], row[3], row[4], row[5])
+                self._insert(key, entry)
+                return entry
+        return None
+
+    def _get_semantic(self, model, article_ids, embedding, context=""):
+        if embedding is None:
+            return None
+        query = np.asarray(embedding, dtype="float32")
+        query = query / (np.linalg.norm(query) or 1.0)
+        best_key, best_score = None, self.semantic_threshold
+        for key, entry in self._entries.items():
+            if entry["embedding"] is None or entry["model"] != model or entry["context"] != context:
+                continue
+            if article_ids is not None and entry["article_ids"] != article_ids:
+                continue
+            if self._expired(entry):
+                continue
+            score = float(np.dot(query, entry["embedding"]))
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key]
+
+    def get(self, query, model, article_ids, embedding=None, context=""):
+        """
+        Return a cached response for the query in this conversation context,
+        or None on a miss.
+        """
+        article_ids = list(article_ids)
+        with self._lock:
+            entry = self._get_exact(cache_key(query, model, article_ids, context))
+            if entry is not None:
+                self.stats_counts["exact_hits"] += 1
+                return entry["response"]
+            entry = self._get_semantic(model, article_ids, embedding, context)
+            if entry is not None:
+                self.stats_counts["semantic_hits"] += 1
+                return entry["response"]
+            self.stats_counts["misses"] += 1
+            return None
+
+    def get_similar(self, model, embedding, context=""):
+        """
+        Semantic lookup over cached answers for any articles (same context),
+        for when a fresh completion cannot be made. Returns the response or None.
+        """
+        with self._lock:
+            entry = self._get_semantic(model, None, embedding, context)
+            if entry is None:
+                return None
+            self.stats_counts["degraded_hits"] += 1
+            return entry["response"]
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, query, model, article_ids, response, embedding=None, context=""):
+        article_ids = list(article_ids)
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype="float32")
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        key = cache_key(query, model, article_ids, context)
+        entry = self._entry(model, article_ids, embedding, response, time.time(), context)
+        with self._lock:
+            self._insert(key, entry)
+            self.stats_counts["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, json.dumps(article_ids),
+                     embedding.tobytes() if embedding is not None else None,
+                     response, entry["created"], entry["context"])
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.stats_counts)
+            counts["entries"] = len(self._entries)
+        lookups = counts["exact_hits"] + counts["semantic_hits"] + counts["misses"]
+        counts["hit_rate"] = ((counts["exact_hits"] + counts["semantic_hits"]) / lookups) if lookups else 0.0
+        return counts
@@ -0,0 +1,120 @@
+import os
+import time
+import numpy as np
+
+from embeddings import get_embedding, get_embeddings
+from embedding_store import STORE_DIR
+from document_store import DocumentStore
+from ingestion import select_passages
+from bm25 import reciprocal_rank_fusion
+from metrics import timed
+
+# ============================================================
+# Shared Retrieval Engine
+# ============================================================
+# One engine per process. chat_core.get_retrieval_engine hands it out through
+# process_singleton, so every session, rerun and request searches the same
+# index instead of rebuilding it.
+# Chunks and vectors live in a DocumentStore (document_store.py); searches run
+# against its current immutable snapshot, so upserts/deletes and snapshots
+# published by other processes swap in without blocking readers. Vectors are
+# normalized, so search scores are cosine similarities (higher is closer);
+# passages below RAG_MIN_SIMILARITY are dropped, so off-topic messages and
+# greetings get no context at all.
+#
+# Retrieval is hybrid: a BM25 index over the same chunks is fused with the
+# vector ranking (reciprocal rank fusion). When BM25 alone is confident (the
+# top chunk covers RAG_LEXICAL_COVERAGE of the query's IDF weight and clearly
+# beats the runner-up) the query is answered without an embedding call. If the
+# embedding call fails (see resilience.py), the BM25 ranking is used alone.
+MIN_SIMILARITY = float(os.getenv("RAG_MIN_SIMILARITY", "0.3"))
+MIN_BM25_SCORE = float(os.getenv("RAG_MIN_BM25_SCORE", "1.0"))
+LEXICAL_COVERAGE = float(os.getenv("RAG_LEXICAL_COVERAGE", "0.8"))
+LEXICAL_MARGIN = float(os.getenv("RAG_LEXICAL_MARGIN", "1.5"))
+SNAPSHOT_POLL_SECONDS = float(os.getenv("RAG_SNAPSHOT_POLL_SECONDS", "5"))
+
+class RetrievalEngine:
+    def __init__(self, articles, embed_fn=get_embedding, store_dir=STORE_DIR, embed_batch_fn=get_embeddings):
+        self.embed_fn = embed_fn
+        self.store = DocumentStore(embed_fn, embed_batch_fn=embed_batch_fn, store_dir=store_dir)
+        self._last_poll = time.monotonic()
+        self.reload(articles)
+
+    def reload(self, articles):
+        """
+        Make the index match the article list, embedding only changed chunks.
+        The new snapshot replaces the old one atomically for concurrent readers.
+        """
+        self.store.sync(articles)
+        print("FAISS index ready with", self.store.snapshot.index.ntotal, "chunks.")
+        return self
+
+    def upsert(self, article):
+        return self.store.upsert(article)
+
+    def delete(self, doc_id):
+        return self.store.delete(doc_id)
+
+    def snapshot(self):
+        now = time.monotonic()
+        if now - self._last_poll >= SNAPSHOT_POLL_SECONDS:
+            self._last_poll = now
+            self.store.refresh_if_changed()
+        return self.store.snapshot
+
+    @property
+    def chunks(self):
+        return self.store.snapshot.chunks
+
+    def _search(self, snapshot, query, k):
+        with timed("query_embedding"):
+            query_embedding = np.array(self.embed_fn(query), dtype="float32")
+        query_embedding /= np.linalg.norm(query_embedding) or 1.0
+        query_embedding = np.expand_dims(query_embedding, axis=0)  # FAISS requires a 2D array
+        with timed("faiss_search"):
+            scores, ids = snapshot.index.search(query_embedding, min(k, snapshot.index.ntotal))
+        # FAISS returns chunk ids; map them to positions in snapshot.chunks
+        positions = [snapshot.position_by_int_id.get(int(i), -1) for i in ids[0]]
+        return np.array(positions, dtype="int64"), scores[0]
+
+    def search(self, query, k=2):
+        """
+        Return (indices, scores) of the k nearest chunks for the query, where
+        indices point into self.chunks and scores are cosine similarities.
+        """
+        return self._search(self.snapshot(), query, k)
+
+    def _lexical_is_confident(self, bm25, query, lexical):
+        if not lexical or lexical[0][1] < MIN_BM25_SCORE:
+            return False
+        if len(lexical) > 1 and lexical[0][1] < LEXICAL_MARGIN * lexical[1][1]:
+            return False
+        return bm25.coverage(query, lexical[0][0]) >= LEXICAL_COVERAGE
+
+    def retrieve_passages(self, query, k=4, token_budget=600, min_similarity=MIN_SIMILARITY):
+        """
+        Return up to k chunks, trimmed to fit the token budget: the fused BM25 +
+        vector ranking, keeping vector hits scoring at least min_similarity and
+        lexical hits scoring at least RAG_MIN_BM25_SCORE. Each chunk carries its
+        cosine "score" (None when only BM25 found it) and "bm25" score.
+        """
+        snapshot = self.snapshot()
+        chunks, bm25 = snapshot.chunks, snapshot.bm25
+        with timed("lexical_search"):
+            lexical = [(i, score) for i, score in bm25.search(query, k) if score >= MIN_BM25_SCORE]
+        bm25_scores = dict(lexical)
+
+        if self._lexical_is_confident(bm25, query, lexical):
+            ranked = [dict(chunks[i], score=None, bm25=score) for i, score in lexical]
+            return select_passages(ranked, token_budget)
+
+        try:
+            indices, scores = self._search(snapshot, query, k)
+        except Exception as e:
+            # Embedding API down or its circuit open: answer from BM25 alone
+            print(f"[Retrieval] Vector search failed, using lexical results only: {e}")
+            indices, scores = [], []
+        dense = {int(i): float(score) for i, score in zip(indices, scores) if i >= 0 and score >= min_similarity}
+        fused = reciprocal_rank_fusion([list(dense), [i for i, _ in lexical]])[:k]
+        ranked = [dict(chunks[i], score=dense.get(i), bm25=bm25_scores.get(i)) for i in fused]
+        return select_passages(ranked, token_budget)
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# ============================================================
+# Per-sender Conversation Sessions for the API services
+# ============================================================
+# The Streamlit app keeps history in st.session_state; the /endpoint APIs key
+# it by the messenger's sender id instead. Two tiers:
+#   memory - LRU of decoded sessions with an idle TTL
+#   sqlite - shared by every worker process (SESSION_DB, WAL mode); each row
+#            carries a version, so a worker re-reads a session only when
+#            another worker changed it
+# Each session keeps at most SESSION_MAX_TURNS turns and SESSION_MAX_CHARS
+# characters (oldest turns are dropped first); the default is a little more
+# than the prompt token budget, so nothing the model could still see is lost.
+# Keep SESSION_MAX_CHARS above the budget: the context manager's running
+# summary is extended only with turns it still finds in the stored history.
+# Rows are stored as zlib-compressed JSON.
+MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+TTL_SECONDS = float(os.getenv("SESSION_TTL", "86400"))
+MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "40"))
+MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", "12000"))
+DB_PATH = os.getenv("SESSION_DB", "sessions.db")
+PURGE_EVERY = 500  # writes between sweeps of expired rows
+
+ROLE_CODES = {"user": "u", "assistant": "a", "system": "s"}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+
+def encode_turns(turns):
+    compact = [[ROLE_CODES.get(t["role"], t["role"]), t["content"]] for t in turns]
+    return zlib.compress(json.dumps(compact, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_turns(blob):
+    compact = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return [{"role": ROLE_NAMES.get(role, role), "content": content} for role, content in compact]
+
+
+def trim_turns(turns, max_turns=MAX_TURNS, max_chars=MAX_CHARS):
+    turns = turns[-max_turns:] if max_turns else list(turns)
+    total = sum(len(t["content"]) for t in turns)
+    while turns and total > max_chars:
+        total -= len(turns.pop(0)["content"])
+    # Never start the window on an assistant reply without its question
+    while turns and turns[0]["role"] == "assistant":
+        turns.pop(0)
+    return turns
+
+
+class SessionStore:
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=TTL_SECONDS, max_turns=MAX_TURNS,
+                 max_chars=MAX_CHARS, db_path=DB_PATH):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # sender_id -> (version, updated, turns)
+        self._writes = 0
+        self.stats_counts = {"memory_hits": 0, "db_reads": 0, "misses": 0, "writes": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "sender_id TEXT PRIMARY KEY, version INTEGER, updated REAL, turns BLOB)"
+            )
+
+    def _remember(self, sender_id, version, updated, turns):
+        self._sessions[sender_id] = (version, updated, turns)
+        self._sessions.move_to_end(sender_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _load(self, sender_id):
+        """
+        Return (version, turns) for a live session, reading SQLite only when
+        the cached copy is missing or stale. Call with self._lock held.
+        """
+        now = time.time()
+        cached = self._sessions.get(sender_id)
+        if cached is not None and now - cached[1] > self.ttl:
+            del self._sessions[sender_id]
+            cached = None
+
+        if self._db is None:
+            if cached is None:
+                self.stats_counts["misses"] += 1
+                return 0, []
+            self.stats_counts["memory_hits"] += 1
+            self._sessions.move_to_end(sender_id)
+            return cached[0], cached[2]
+
+        row = self._db.execute("SELECT version, updated FROM sessions WHERE sender_id = ?", (sender_id,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self._sessions.pop(sender_id, None)
+            self.stats_counts["misses"] += 1
+            return 0, []
+        if cached is not None and cached[0] == row[0]:
+            self.stats_counts["memory_hits"] += 1
+            self._sessions.move_to_end(sender_id)
+            return cached[0], cached[2]
+
+        blob = self._db.execute("SELECT turns FROM sessions WHERE sender_id = ?", (sender_id,)).fetchone()[0]
+        turns = decode_turns(blob)
+        self._remember(sender_id, row[0], row[1], turns)
+        self.stats_counts["db_reads"] += 1
+        return row[0], turns
+
+    def get(self, sender_id):
+        """
+        Return the session's turns ({"role", "content"}, oldest first), or []
+        for a new or expired session.
+        """
+        with self._lock:
+            _, turns = self._load(sender_id)
+            return list(turns)
+
+    def append(self, sender_id, new_turns):
+        """
+        Append turns to a session, trimming it to the per-session limits. The
+        read-modify-write is one SQLite transaction, so concurrent workers
+        appending to the same sender do not lose turns.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.execute("BEGIN IMMEDIATE")
+            try:
+                version, turns = self._load(sender_id)
+                turns = trim_turns(turns + list(new_turns), self.max_turns, self.max_chars)
+                version, updated = version + 1, time.time()
+                if self._db is not None:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                        (sender_id, version, updated, encode_turns(turns))
+                    )
+                    self._db.execute("COMMIT")
+            except Exception:
+                if self._db is not None:
+                    self._db.execute("ROLLBACK")
+                raise
+            self._remember(sender_id, version, updated, turns)
+            self.stats_counts["writes"] += 1
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._purge_expired()
+            return list(turns)
+
+    def clear(self, sender_id):
+        with self._lock:
+            self._sessions.pop(sender_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE sender_id = ?", (sender_id,))
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl
+        for sender_id in [s for s, (_, updated, _) in self._sessions.items() if updated < cutoff]:
+            del self._sessions[sender_id]
+        if self._db is not None:
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.stats_counts)
+            counts["sessions_in_memory"] = len(self._sessions)
+        reads = counts["memory_hits"] + counts["db_reads"]
+        counts["memory_hit_rate"] = (counts["memory_hits"] / reads) if reads else 0.0
+        return counts
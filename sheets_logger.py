@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import queue
+import atexit
+import datetime
+import threading
+
+from metrics import timed
+
+# ============================================================
+# Background, Batched Google Sheets Logging
+# ============================================================
+# Chat turns only enqueue a row; a daemon thread flushes the queue with one
+# append_rows call when SHEETS_BATCH_SIZE rows are waiting or every
+# SHEETS_FLUSH_INTERVAL seconds. The authorized client and sheet handle are
+# cached between flushes. If a flush fails, the rows are appended to a local
+# JSONL spill file and replayed ahead of the next successful flush.
+SHEET_NAME = "Chatlogs Terrapeak"
+BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "20"))
+FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "5"))
+SPILL_FILE = os.getenv("SHEETS_SPILL_FILE", "sheets_spill.jsonl")
+
+
+def build_row(data):
+    return [
+        datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        data.get("name", ""),
+        data.get("email", ""),
+        data.get("company", ""),
+        data.get("phone", ""),
+        data.get("country", ""),
+        data.get("question", ""),
+        data.get("response", ""),
+        data.get("intent", ""),
+        data.get("cta_triggered", ""),
+        data.get("message_number", ""),
+        data.get("session_id", "")
+    ]
+
+
+class SheetsLogWriter:
+    def __init__(self, authenticate_fn, sheet_name=SHEET_NAME, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, spill_file=SPILL_FILE):
+        self.authenticate_fn = authenticate_fn
+        self.sheet_name = sheet_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_file = spill_file
+        self._queue = queue.Queue()
+        self._sheet = None
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheets-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, data):
+        """
+        Queue one row for the sheet. Never blocks on the network.
+        """
+        self._queue.put(build_row(data))
+        return True
+
+    def _get_sheet(self):
+        if self._sheet is None:
+            client = self.authenticate_fn()
+            self._sheet = client.open(self.sheet_name).sheet1
+        return self._sheet
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _read_spill(self):
+        if not os.path.isfile(self.spill_file):
+            return []
+        rows = []
+        with open(self.spill_file, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    rows.append(json.loads(line))
+        return rows
+
+    def _spill(self, rows):
+        with open(self.spill_file, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        with self._flush_lock:
+            rows = self._drain()
+            try:
+                spilled = self._read_spill()
+            except (OSError, ValueError) as e:
+                print(f"[Google Sheets Logging Error] Unreadable spill file: {e}")
+                spilled = []
+            if not rows and not spilled:
+                return 0
+
+            try:
+                with timed("sheets_write"):
+                    self._get_sheet().append_rows(spilled + rows, value_input_option="RAW")
+            except Exception as e:
+                # Drop the cached handle so the next flush re-authenticates
+                self._sheet = None
+                print(f"[Google Sheets Logging Error] {e}")
+                if rows:
+                    self._spill(rows)
+                return 0
+
+            if spilled:
+                os.remove(self.spill_file)
+            return len(spilled) + len(rows)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stop.is_set():
+            self._stop.wait(0.2)
+            due = time.monotonic() - last_flush >= self.flush_interval
+            if self._queue.qsize() >= self.batch_size or due:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
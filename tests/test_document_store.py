@@ -0,0 +1,45 @@
+import os
+import hashlib
+
+import numpy as np
+
+from document_store import DocumentStore
+
+
+def fake_embedding(text, model=None):
+    seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(16).astype("float32")
+
+
+def faq(doc_id):
+    return {"id": doc_id, "title": doc_id, "content": f"Answer for {doc_id} about knee and shoulder pain."}
+
+
+def test_writers_sharing_a_store_keep_each_others_changes(tmp_path):
+    store_dir = str(tmp_path)
+    DocumentStore(fake_embedding, store_dir=store_dir).sync([faq("faq1")])
+    a = DocumentStore(fake_embedding, store_dir=store_dir)
+    b = DocumentStore(fake_embedding, store_dir=store_dir)
+    assert a.snapshot.version == b.snapshot.version == 1
+
+    a.upsert(faq("faq2"))
+    b.upsert(faq("faq3"))  # b still holds v1 in memory
+
+    on_disk = DocumentStore(fake_embedding, store_dir=store_dir).snapshot
+    assert on_disk.version == 3
+    assert on_disk.doc_ids == {"faq1", "faq2", "faq3"}
+    assert a.refresh_if_changed()
+    assert a.snapshot.doc_ids == {"faq1", "faq2", "faq3"}
+
+
+def test_sync_applies_to_the_latest_published_snapshot(tmp_path):
+    store_dir = str(tmp_path)
+    DocumentStore(fake_embedding, store_dir=store_dir).sync([faq("faq1")])
+    a = DocumentStore(fake_embedding, store_dir=store_dir)
+    b = DocumentStore(fake_embedding, store_dir=store_dir)
+
+    a.upsert(faq("faq2"))
+    b.sync([faq("faq1"), faq("faq3")])  # replaces the whole store, faq2 included
+
+    assert b.snapshot.doc_ids == {"faq1", "faq3"}
+    assert not any(name.endswith(".tmp") for _, _, files in os.walk(store_dir) for name in files)
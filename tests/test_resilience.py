@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+import pytest
+
+from rate_limiter import AdaptiveScheduler, SchedulerTimeout
+from resilience import CallPolicy, CircuitOpen, DeadlineExceeded
+
+
+def one_slot_scheduler():
+    return AdaptiveScheduler("test", requests_per_min=100000, tokens_per_min=10000000,
+                             initial_concurrency=1, max_concurrency=1)
+
+
+def policy(**options):
+    settings = dict(deadline=0.6, attempt_timeout=0.3, max_attempts=2, hedge=True, hedge_delay=1.0,
+                    breaker_failures=2, breaker_cooldown=30.0)
+    settings.update(options)
+    return CallPolicy("test", **settings)
+
+
+def test_full_local_queue_does_not_open_the_breaker():
+    scheduler = one_slot_scheduler()
+    busy = scheduler.acquire(timeout=1)  # another call holds the only slot
+    upstream_calls = []
+
+    def attempt(timeout):
+        with scheduler.slot(timeout=timeout):
+            upstream_calls.append(timeout)
+            return "reply"
+
+    test_policy = policy()
+    try:
+        for _ in range(4):
+            with pytest.raises(SchedulerTimeout):
+                test_policy.call(attempt)
+    finally:
+        scheduler.release(busy)
+
+    assert upstream_calls == []
+    assert not test_policy.breaker.is_open()
+    assert test_policy.breaker.failures == 0
+    assert test_policy.call(attempt) == "reply"
+
+
+def test_full_local_queue_does_not_open_the_breaker_async():
+    scheduler = one_slot_scheduler()
+    upstream_calls = []
+
+    async def attempt(timeout):
+        async with scheduler.aslot(timeout=timeout):
+            upstream_calls.append(timeout)
+            return "reply"
+
+    async def run(test_policy):
+        busy = await scheduler.acquire_async(timeout=1)
+        try:
+            for _ in range(4):
+                with pytest.raises(SchedulerTimeout):
+                    await test_policy.acall(attempt)
+        finally:
+            scheduler.release(busy)
+        assert upstream_calls == []
+        assert not test_policy.breaker.is_open()
+        return await test_policy.acall(attempt)
+
+    assert asyncio.run(run(policy())) == "reply"
+
+
+def test_slow_upstream_still_opens_the_breaker():
+    scheduler = one_slot_scheduler()
+
+    def attempt(timeout):
+        with scheduler.slot(timeout=timeout):
+            time.sleep(timeout + 0.2)  # OpenAI does not answer in time
+            return "late"
+
+    test_policy = policy(max_attempts=1)
+    for _ in range(2):
+        with pytest.raises(DeadlineExceeded):
+            test_policy.call(attempt)
+    assert test_policy.breaker.is_open()
+    with pytest.raises(CircuitOpen):
+        test_policy.call(attempt)